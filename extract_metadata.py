@@ -1,21 +1,7 @@
 """pulls metadata from svg file"""
 
-import xml.etree.ElementTree as ET
 import json
-
-
-def extract_embeded_model(filename):
-    """extracts embeded model if there is one in metadata"""
-    model = None
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    for metadata in root.findall('{http://www.w3.org/2000/svg}metadata'):
-        lasermetadata = metadata.find(
-            '{http://www.w3.org/2000/svg}laserassistant')
-        if lasermetadata is not None:
-            model = json.loads(lasermetadata.attrib['model'])
-    return model
+from laser_svg_parser import extract_embeded_model
 
 
 if __name__ == "__main__":
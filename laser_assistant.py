@@ -1,19 +1,53 @@
 # laser_assistant.py
 """A tool to generate joints for laser cutting"""
-import xml.etree.ElementTree as ET
 import json
+import io
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from laser_path_utils import (get_length, get_start, get_angle,
                               move_path, rotate_path, scale_path,
-                              get_overlapping, get_not_overlapping,
+                              split_overlapping,
                               paths_to_loops, loops_to_paths,
-                              separate_closed_paths, is_inside,
-                              path_to_segments)
-from laser_clipper import get_difference, get_offset_loop, get_union
-import svgpathtools.svgpathtools as SVGPT
-from laser_svg_parser import separate_perims_from_cuts, parse_svgfile
+                              separate_closed_paths, path_to_segments,
+                              element_to_combined_path,
+                              path_string_to_loop, placement_matrix,
+                              transform_loops, get_bounding_box,
+                              get_box_index, query_box_index,
+                              count_path_vertices, FLATTEN_TOLERANCE,
+                              MIN_FLATTEN_TOLERANCE)
+from laser_clipper import (get_difference, get_offset_loop,
+                           get_joined_difference, loop_inside_loop,
+                           JOIN_TYPES, MITER_LIMIT, ARC_TOLERANCE)
+from laser_svg_parser import (separate_perims_from_cuts, read_svg,
+                              root_attributes, stream_svg)
+from laser_cache import ResultCache, result_key
+from laser_metrics import timed, count
 # from joint_generators import FlatJoint, BoxJoint, TslotJoint
 
+# worker processes for per-face geometry, LASER_WORKERS=1 keeps everything
+# in this process (default is one per cpu)
+FACE_WORKERS = int(os.environ.get('LASER_WORKERS', 0)) or os.cpu_count() or 1
+# models with fewer faces than this are processed serially, since starting
+# work in another process costs more than small faces take
+PARALLEL_FACE_THRESHOLD = 8
+# workers are started fresh rather than forked, since forking the threaded
+# web server could copy a lock another thread holds into the child
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    FACE_POOL_START_METHOD = 'forkserver'
+else:
+    FACE_POOL_START_METHOD = 'spawn'
+
+_FACE_POOLS = {}
+_FACE_POOLS_LOCK = threading.Lock()
+
+# processed face paths by hash of the face, the joints touching it and the
+# laser parameters, so editing one joint only recomputes the faces it joins
+FACE_CACHE = ResultCache(max_bytes=32 * 1024 * 1024)
+
 
 def make_blank_model(attrib=None):
     """Make a valid blank model"""
@@ -40,6 +74,52 @@ def place_new_edge_path(new_edge_path, old_edge_path):
     return rotated_path
 
 
+def get_alignment_offset(thickness, alignment):
+    """returns (x, y) offset of a joint aligned inside, middle, or outside"""
+    offsets = {'Inside': 0.0,
+               'Middle': -thickness/2.0,
+               'Outside': -thickness}
+    return (0.0, offsets[alignment])
+
+
+def place_joint(joint_path, old_edge_path, thickness=0.0, alignment='Inside'):
+    """returns joint path with the matrix that moves it into place,
+    flattening and the actual transform are deferred to place_joint_geometry"""
+    offset = get_alignment_offset(thickness, alignment)
+    matrix = placement_matrix(old_edge_path, offset)
+    return (joint_path, matrix)
+
+
+def place_joint_geometry(joint_geometry, tolerance=FLATTEN_TOLERANCE):
+    """takes a list of {face: [(path, matrix)]} and transforms every joint
+    at once, returning a list of {face: [loop]}"""
+    loops = []
+    matrices = []
+    flattened_geometry = []
+    for faces in joint_geometry:
+        flattened_faces = {}
+        for face, placements in faces.items():
+            flattened_faces[face] = []
+            for joint_path, matrix in placements:
+                points = path_string_to_loop(joint_path, tolerance)
+                if points is not None:
+                    loops.append(points)
+                    matrices.append(matrix)
+                flattened_faces[face].append(points)
+        flattened_geometry.append(flattened_faces)
+
+    placed_loops = iter(transform_loops(loops, matrices))
+    placed_geometry = []
+    for faces in flattened_geometry:
+        placed_faces = {}
+        for face, flattened in faces.items():
+            placed_faces[face] = [next(placed_loops)
+                                  for points in flattened
+                                  if points is not None]
+        placed_geometry.append(placed_faces)
+    return placed_geometry
+
+
 def process_edge(a_or_b, edge, parameters):
     """Generates, translates and rotates joint path into place"""
     assert 'paths' in edge
@@ -55,25 +135,16 @@ def process_edge(a_or_b, edge, parameters):
     return placed_path
 
 
-def subtract_geometry(perimeters, cuts):
+def subtract_geometry(perimeters, cuts, tolerance=FLATTEN_TOLERANCE):
     """subtracts cuts from faces"""
-    perimeters_loops = paths_to_loops(perimeters)
-    cuts_loops = paths_to_loops(cuts)
+    perimeters_loops = paths_to_loops(perimeters, tolerance)
+    cuts_loops = paths_to_loops(cuts, tolerance)
     differnce_loops = get_difference(perimeters_loops, cuts_loops)
     differnce = loops_to_paths(differnce_loops)
     # differnce = loops_to_paths(cuts_loops)
     return differnce
 
 
-def combine_geometry(first, second):
-    """combines two path lists"""
-    first_loops = paths_to_loops(first)
-    second_loops = paths_to_loops(second)
-    combined_loops = get_union(first_loops, second_loops)
-    combined = loops_to_paths(combined_loops)
-    # differnce = loops_to_paths(cuts_loops)
-    return combined
-
 # def get_original(tree):
 #     """returns paths of original and target geometry"""
 #     original_style = "fill:#00ff00;fill-opacity:0.1;stroke:#000000;" + \
@@ -100,42 +171,160 @@ def combine_geometry(first, second):
 #     return tree
 
 
-def get_original_tree(model):
+def get_face_pool(workers):
+    """returns a shared process pool with the given number of workers"""
+    with _FACE_POOLS_LOCK:
+        if workers not in _FACE_POOLS:
+            _FACE_POOLS[workers] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(FACE_POOL_START_METHOD))
+        return _FACE_POOLS[workers]
+
+
+def discard_face_pool(workers, pool):
+    """drops a broken pool so the next get_face_pool starts a new one"""
+    with _FACE_POOLS_LOCK:
+        if _FACE_POOLS.get(workers) is pool:
+            del _FACE_POOLS[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def map_faces(function, jobs, workers=None):
+    """runs function on each per-face job and yields the results in order,
+    fanned out to a process pool for big models and serial for small ones"""
+    if workers is None:
+        workers = FACE_WORKERS
+    if workers <= 1 or len(jobs) < PARALLEL_FACE_THRESHOLD:
+        return (function(job) for job in jobs)
+    return map_faces_in_pool(function, jobs, workers)
+
+
+def map_faces_in_pool(function, jobs, workers):
+    """yields function(job) for each job from the process pool, if the pool
+    breaks (eg. a worker was killed) it is dropped and the rest run serially"""
+    chunk_size = max(1, len(jobs) // (workers * 4))
+    pool = get_face_pool(workers)
+    done = 0
+    try:
+        for result in pool.map(function, jobs, chunksize=chunk_size):
+            yield result
+            done += 1
+    except BrokenProcessPool:
+        discard_face_pool(workers, pool)
+        for job in jobs[done:]:
+            yield function(job)
+
+
+def report_progress(progress, stage, done, total):
+    """calls progress(stage, done, total) if there is a progress callback"""
+    if progress is not None:
+        progress(stage, done, total)
+
+
+def get_face_shapes(shapes):
+    """returns (perimeter paths, cut paths) of a face"""
+    perimeters = list(shapes['Perimeter']['paths'])
+    cuts = list(shapes['Cuts']['paths'])
+    return (perimeters, cuts)
+
+
+def original_face(job):
+    """returns paths of a face with its cuts subtracted"""
+    perimeters, cuts, tolerance = job
+    if cuts != []:
+        return subtract_geometry(perimeters, cuts, tolerance)
+    return perimeters
+
+
+def get_original_tree(model, tolerance=FLATTEN_TOLERANCE, workers=None):
     """returns paths (zero stroke with green fill) of original model"""
-    tree = {}
-    for face, shapes in model['tree'].items():
-        if face.startswith('face'):
-            perimeters = []
-            perimeter_paths = shapes['Perimeter']['paths']
-            for path in perimeter_paths:
-                perimeters.append(path)
-            cuts = []
-            cut_paths = shapes['Cuts']['paths']
-            if cut_paths != []:
-                for path in cut_paths:
-                    cuts.append(path)
-                tree[face] = {
-                    'paths': subtract_geometry(perimeters, cuts)}
-            else:
-                tree[face] = {
-                    'paths': perimeters}
-    return tree
-
-
-def process_joints(model, joints, parameters):
-    """takes in model of paces and returns modified model with joints applied"""
+    faces = [face for face in model['tree'] if face.startswith('face')]
+    jobs = [get_face_shapes(model['tree'][face]) + (tolerance,)
+            for face in faces]
+    face_paths = map_faces(original_face, jobs, workers)
+    return {face: {'paths': paths} for face, paths in zip(faces, face_paths)}
+
+
+@timed('joints')
+def get_joint_loops(joints, model, parameters):
+    """returns placed joint geometry as ({face: [add loop]}, {face: [cut loop]})"""
+    tolerance = get_tolerance(parameters)
+    joint_adds = []
+    joint_cuts = []
     for _, joint in joints.items():
-        extensions = get_joint_adds(joint, model, parameters)
-        for face, extension in extensions.items():
-            model['tree'][face]['paths'] = combine_geometry(
-                model['tree'][face]['paths'], extension)
-
-    for _, joint in joints.items():
-        cuts = get_joint_cuts(joint, model, parameters)
-        for face, cut in cuts.items():
-            model['tree'][face]['paths'] = subtract_geometry(
-                model['tree'][face]['paths'], cut)
-    return model
+        joint_adds.append(get_joint_adds(joint, model, parameters))
+        joint_cuts.append(get_joint_cuts(joint, model, parameters))
+
+    placed = place_joint_geometry(joint_adds + joint_cuts, tolerance)
+    placed_adds = placed[:len(joint_adds)]
+    placed_cuts = placed[len(joint_adds):]
+
+    return (collect_face_loops(placed_adds), collect_face_loops(placed_cuts))
+
+
+def get_face_joints(joints):
+    """returns {face: [joint name]} of the joints touching each face"""
+    face_joints = {}
+    for name, joint in joints.items():
+        for edge in ('edge_a', 'edge_b'):
+            face = joint[edge]['face']
+            if name not in face_joints.setdefault(face, []):
+                face_joints[face].append(name)
+    return face_joints
+
+
+def get_face_key(shapes, joints, parameters):
+    """hash of everything a processed face depends on"""
+    return result_key('face', shapes['Perimeter']['paths'], shapes['Cuts']['paths'],
+                      joints, parameters)
+
+
+def get_tolerance(parameters):
+    """returns the curve flattening tolerance of the laser parameters
+    ('tolerance', a number > 0), raised to MIN_FLATTEN_TOLERANCE at least
+    so curves can't be split into unbounded numbers of lines"""
+    tolerance = parameters.get('tolerance', FLATTEN_TOLERANCE)
+    if isinstance(tolerance, bool) or not isinstance(tolerance, (int, float)) \
+            or not tolerance > 0:
+        raise ValueError(f"tolerance must be a number above 0, not {tolerance!r}")
+    return max(float(tolerance), MIN_FLATTEN_TOLERANCE)
+
+
+def get_kerf_join(parameters, face):
+    """returns (join type, miter limit, arc tolerance) for the kerf offset of a face,
+    'kerf_join' in the parameters is a join type or a dict of join types
+    by face name or material (default 'round'), raises ValueError for other join types"""
+    kerf_join = parameters.get('kerf_join', 'round')
+    if isinstance(kerf_join, dict):
+        kerf_join = kerf_join.get(face, kerf_join.get(parameters.get('material'), 'round'))
+    if not isinstance(kerf_join, str) or kerf_join not in JOIN_TYPES:
+        raise ValueError(f"kerf_join must be one of {', '.join(JOIN_TYPES)}, "
+                         f"not {kerf_join!r}")
+    return (kerf_join,
+            parameters.get('miter_limit', MITER_LIMIT),
+            parameters.get('arc_tolerance', ARC_TOLERANCE))
+
+
+@timed('face')
+def processed_face(job):
+    """returns kerf offset paths of a face with its cuts and joints applied,
+    everything one face needs comes in the job so it can run in a worker"""
+    perimeters, cuts, adds, joint_cuts, kerf_size, tolerance, kerf_join = job
+    loops = paths_to_loops(perimeters, tolerance)
+    if cuts != []:
+        loops = get_difference(loops, paths_to_loops(cuts, tolerance))
+    if adds != [] or joint_cuts != []:
+        loops = get_joined_difference(loops, adds, joint_cuts)
+    return loops_to_paths(get_offset_loop(loops, kerf_size, *kerf_join))
+
+
+def collect_face_loops(joint_geometry):
+    """merges a list of {face: [loop]} into one {face: [loop]}"""
+    face_loops = {}
+    for faces in joint_geometry:
+        for face, loops in faces.items():
+            face_loops.setdefault(face, []).extend(loops)
+    return face_loops
 
 
 def get_box_joint_cuts(joint, _, parameters):
@@ -192,11 +381,8 @@ def get_box_joint_cuts(joint, _, parameters):
     cutb += f"M {position+fit} {0} " + f"L {position+fit} {thickness} " + \
             f"L {lengthb} {thickness} " + f"L {lengthb} {0} Z "
 
-    cuta = align_joint(cuta, lengtha, thickness, alignment)
-    cutb = align_joint(cutb, lengthb, thickness, alignment)
-
-    cuts[facea] = [place_new_edge_path(cuta, patha)]
-    cuts[faceb] = [place_new_edge_path(cutb, pathb)]
+    cuts[facea] = [place_joint(cuta, patha, thickness, alignment)]
+    cuts[faceb] = [place_joint(cutb, pathb, thickness, alignment)]
 
     return cuts
 
@@ -218,11 +404,8 @@ def get_interlock_joint_adds(joint, _, parameters):
     addb = f"M {0} {thickness} "+f"L {0} {-thickness} " + \
         f"L {lengthb} {-thickness} " + f"L {lengthb} {thickness}"
 
-    adda = align_joint(adda, lengtha, thickness, alignment)
-    addb = align_joint(addb, lengthb, thickness, alignment)
-
-    adds[facea] = [place_new_edge_path(adda, patha)]
-    adds[faceb] = [place_new_edge_path(addb, pathb)]
+    adds[facea] = [place_joint(adda, patha, thickness, alignment)]
+    adds[faceb] = [place_joint(addb, pathb, thickness, alignment)]
 
     return adds
 
@@ -244,11 +427,8 @@ def get_box_joint_adds(joint, _, parameters):
     addb = f"M {0} {0} "+f"L {0} {thickness} " + \
         f"L {lengthb} {thickness} " + f"L {lengthb} {0}"
 
-    adda = align_joint(adda, lengtha, thickness, alignment)
-    addb = align_joint(addb, lengthb, thickness, alignment)
-
-    adds[facea] = [place_new_edge_path(adda, patha)]
-    adds[faceb] = [place_new_edge_path(addb, pathb)]
+    adds[facea] = [place_joint(adda, patha, thickness, alignment)]
+    adds[faceb] = [place_joint(addb, pathb, thickness, alignment)]
 
     return adds
 
@@ -270,11 +450,8 @@ def get_tabslot_joint_adds(joint, _, parameters):
     addb = f"M {0} {0} "+f"L {0} {thickness} " + \
         f"L {lengthb} {thickness} " + f"L {lengthb} {0}"
 
-    adda = align_joint(adda, lengtha, thickness, alignment)
-    addb = align_joint(addb, lengthb, thickness, alignment)
-
-    adds[facea] = [place_new_edge_path(adda, patha)]
-    adds[faceb] = [place_new_edge_path(addb, pathb)]
+    adds[facea] = [place_joint(adda, patha, thickness, alignment)]
+    adds[faceb] = [place_joint(addb, pathb, thickness, alignment)]
 
     return adds
 
@@ -296,11 +473,8 @@ def get_bolt_joint_adds(joint, _, parameters):
     addb = f"M {0} {0} "+f"L {0} {thickness} " + \
         f"L {lengthb} {thickness} "+f"L {lengthb} {0}"
 
-    adda = align_joint(adda, lengtha, thickness, alignment)
-    addb = align_joint(addb, lengthb, thickness, alignment)
-
-    adds[facea] = [place_new_edge_path(adda, patha)]
-    adds[faceb] = [place_new_edge_path(addb, pathb)]
+    adds[facea] = [place_joint(adda, patha, thickness, alignment)]
+    adds[faceb] = [place_joint(addb, pathb, thickness, alignment)]
 
     return adds
 
@@ -359,11 +533,8 @@ def get_tabslot_joint_cuts(joint, _, parameters):
     cutb += f"M {position+fit} {0} " + f"L {position+fit} {thickness} " + \
             f"L {lengthb} {thickness} " + f"L {lengthb} {0} Z "
 
-    cuta = align_joint(cuta, lengtha, thickness, alignment)
-    cutb = align_joint(cutb, lengthb, thickness, alignment)
-
-    cuts[facea] = [place_new_edge_path(cuta, patha)]
-    cuts[faceb] = [place_new_edge_path(cutb, pathb)]
+    cuts[facea] = [place_joint(cuta, patha, thickness, alignment)]
+    cuts[faceb] = [place_joint(cutb, pathb, thickness, alignment)]
 
     return cuts
 
@@ -430,22 +601,19 @@ def get_bolt_joint_cuts(joint, _, parameters):
             f"L {position+nut_width} {thickness} " + \
             f"L {position+nut_width} {0} " + \
             f"L {position} {0} "
-        cuta = align_joint(cuta, lengtha, thickness, alignment)
-        cuts[facea].append(place_new_edge_path(cuta, patha))
+        cuts[facea].append(place_joint(cuta, patha, thickness, alignment))
         cuta = f"M {position+nut_width+x_1} {thickness/2} " + \
             f"A {bolt_diameter/2} {bolt_diameter/2} 0 0 1 " + \
             f"{position+nut_width+x_1 + bolt_diameter} {thickness/2} " + \
             f"M {position+nut_width+x_1 + bolt_diameter} {thickness/2} " + \
             f"A {bolt_diameter/2} {bolt_diameter/2} 0 0 1 " + \
             f"{position+nut_width+x_1} {thickness/2} "
-        cuta = align_joint(cuta, lengtha, thickness, alignment)
-        cuts[facea].append(place_new_edge_path(cuta, patha))
+        cuts[facea].append(place_joint(cuta, patha, thickness, alignment))
         cuta = f"M {position+2*nut_width} {0} " + \
             f"L {position+2*nut_width} {thickness} " + \
             f"L {position+nut_width+2*nut_width} {thickness} " + \
             f"L {position+nut_width+2*nut_width} {0} Z "
-        cuta = align_joint(cuta, lengtha, thickness, alignment)
-        cuts[facea].append(place_new_edge_path(cuta, patha))
+        cuts[facea].append(place_joint(cuta, patha, thickness, alignment))
         position = position + bolt_space + segment_length
 
     # cuta += f"M {position} {0} " + \
@@ -462,8 +630,7 @@ def get_bolt_joint_cuts(joint, _, parameters):
         f"L {lengthb} {thickness} " + \
         f"L {lengthb - buffer_size_b} {thickness} " + \
         f"L {lengthb - buffer_size_b} {0} Z "
-    cutb = align_joint(cutb, lengthb, thickness, alignment)
-    cuts[faceb].append(place_new_edge_path(cutb, pathb))
+    cuts[faceb].append(place_joint(cutb, pathb, thickness, alignment))
 
     position = buffer_size_b
     for bolt in range(bolt_num):
@@ -471,15 +638,13 @@ def get_bolt_joint_cuts(joint, _, parameters):
             f"L {position+nut_width} {thickness} " + \
             f"L {position+nut_width*2} {thickness} " + \
             f"L {position+nut_width*2} {0} Z "
-        cutb = align_joint(cutb, lengthb, thickness, alignment)
-        cuts[faceb].append(place_new_edge_path(cutb, pathb))
+        cuts[faceb].append(place_joint(cutb, pathb, thickness, alignment))
         if bolt < bolt_num:
             cutb = f"M {position+segment_length} {0} " + \
                 f"L {position+segment_length} {thickness} " + \
                 f"L {position+segment_length+bolt_space} {thickness} " + \
                 f"L {position+segment_length+bolt_space} {0} Z "
-            cutb = align_joint(cutb, lengthb, thickness, alignment)
-            cuts[faceb].append(place_new_edge_path(cutb, pathb))
+            cuts[faceb].append(place_joint(cutb, pathb, thickness, alignment))
         position = position + bolt_space + segment_length
 
     position = buffer_size_b
@@ -496,8 +661,7 @@ def get_bolt_joint_cuts(joint, _, parameters):
             f"L {position+nut_width+x_3} {y_2} " + \
             f"L {position+nut_width+x_2} {y_2} " + \
             f"L {position+nut_width+x_2} {y_0} Z "
-        cutb = align_joint(cutb, lengthb, thickness, alignment)
-        cuts[faceb].append(place_new_edge_path(cutb, pathb))
+        cuts[faceb].append(place_joint(cutb, pathb, thickness, alignment))
         position = position + bolt_space + segment_length
 
     #cutb = f"M {lengt} {0} L {0} {thickness} L {buffer_size_b} {thickness} L {buffer_size_b} {0} Z"
@@ -547,8 +711,8 @@ def get_divider_joint_cuts(joint, _, parameters):
     # cuta = align_joint(cuta, lengtha, thickness, alignment)
     # cutb = align_joint(cutb, lengthb, thickness, alignment)
 
-    cuts[facea] = [place_new_edge_path(cuta, patha)]
-    cuts[faceb] = [place_new_edge_path(cutb, pathb)]
+    cuts[facea] = [place_joint(cuta, patha)]
+    cuts[faceb] = [place_joint(cutb, pathb)]
 
     return cuts
 
@@ -589,11 +753,9 @@ def get_interlock_joint_cuts(joint, _, parameters):
            f"L {0} {thickness-fit}" + \
            f"L {cut_length} {thickness-fit}" + \
            f"L {cut_length} {0} Z "
-    cuta = align_joint(cuta, lengtha, thickness, alignment)
-    cutb = align_joint(cutb, lengthb, thickness, alignment)
 
-    cuts[facea] = [place_new_edge_path(cuta, patha)]
-    cuts[faceb] = [place_new_edge_path(cutb, pathb)]
+    cuts[facea] = [place_joint(cuta, patha, thickness, alignment)]
+    cuts[faceb] = [place_joint(cutb, pathb, thickness, alignment)]
 
     return cuts
 
@@ -642,7 +804,7 @@ def get_flat_joint_cuts(joint, _, parameters):
     # cuta = align_joint(cuta, lengtha, thickness, alignment)
     # cutb = align_joint(cutb, lengthb, thickness, alignment)
 
-    cuts[facea] = [place_new_edge_path(cuta, patha)]
+    cuts[facea] = [place_joint(cuta, patha)]
     print(cuts[facea])
     # cuts[faceb] = [place_new_edge_path(cutb, pathb)]
     return cuts
@@ -672,83 +834,121 @@ def align_joint(path, length, thickness, alignment):
     return new_path
 
 
-def kerf_offset(model, parameters):
-    """Applies a kerf offset based upon material and laser parameters"""
-    kerf_size = parameters['kerf']
-    original_tree = model['tree']
-    tree = {}
-    for face, shapes in original_tree.items():
-        if face.startswith('face'):
-            original = shapes['paths']
-            kerf_path = get_kerf(original, kerf_size)
-            tree[face] = {
-                'paths': kerf_path}
-
-    return tree
-
-
-def get_processed_model(model, parameters):
-    """returns model containing paths of target geometry for each face"""
+@timed('output')
+def get_processed_model(model, parameters, workers=None, progress=None):
+    """returns model containing paths of target geometry for each face,
+    faces are processed in parallel (see map_faces)"""
 
     output_model = make_blank_model(model['attrib'])
     # output_model['attrib'] = model['attrib']
 
-    original_model = get_original_model(model)
-    processed_model = process_joints(
-        original_model, model['joints'], parameters)
-    output_model['tree'] = kerf_offset(processed_model, parameters)
+    tolerance = get_tolerance(parameters)
+    joints = model['joints']
+    face_joints = get_face_joints(joints)
+    # joints can only be applied to faces
+    for face in face_joints:
+        if face not in model['tree'] or not face.startswith('face'):
+            raise KeyError(face)
+
+    faces = [face for face in model['tree'] if face.startswith('face')]
+    face_keys = {}
+    face_paths = {}
+    for face in faces:
+        touching = [joints[name] for name in face_joints.get(face, [])]
+        face_keys[face] = get_face_key(model['tree'][face], touching, parameters)
+        cached = FACE_CACHE.get(face_keys[face])
+        if cached is not None:
+            face_paths[face] = json.loads(cached)
+    count('face_cache.hits', len(face_paths))
+    count('face_cache.misses', len(faces) - len(face_paths))
+
+    # only the joints touching faces that changed need generating
+    changed = [face for face in faces if face not in face_paths]
+    changed_joints = {name: joints[name] for face in changed
+                      for name in face_joints.get(face, [])}
+    report_progress(progress, 'joints', 0, len(changed_joints))
+    face_adds, face_cuts = get_joint_loops(changed_joints, model, parameters)
+    report_progress(progress, 'joints', len(changed_joints), len(changed_joints))
+
+    jobs = [get_face_shapes(model['tree'][face]) +
+            (face_adds.get(face, []), face_cuts.get(face, []),
+             parameters['kerf'], tolerance, get_kerf_join(parameters, face))
+            for face in changed]
+    report_progress(progress, 'faces', 0, len(changed))
+    face_results = zip(changed, map_faces(processed_face, jobs, workers))
+    for done, (face, paths) in enumerate(face_results, 1):
+        FACE_CACHE.put(face_keys[face], json.dumps(paths).encode("utf-8"))
+        face_paths[face] = paths
+        report_progress(progress, 'faces', done, len(changed))
+
+    output_model['tree'] = {face: {'paths': face_paths[face]} for face in faces}
+    output_model['vertices'] = {face: count_path_vertices(face_paths[face])
+                                for face in faces}
+    count('kerf.vertices', sum(output_model['vertices'].values()))
 
     return output_model
 
 
-def get_kerf(paths, kerf_size):
-    """calculate kerf compensated path using PyClipper"""
+def get_kerf(paths, kerf_size, tolerance=FLATTEN_TOLERANCE, kerf_join=('round',)):
+    """calculate kerf compensated path using PyClipper,
+    kerf_join is (join type, miter limit, arc tolerance) as from get_kerf_join"""
     # PyClipper understands loops not paths
-    loops = paths_to_loops(paths)
-    kerf_loops = get_offset_loop(loops, kerf_size)
+    loops = paths_to_loops(paths, tolerance)
+    kerf_loops = get_offset_loop(loops, kerf_size, *kerf_join)
     # change back into paths for output
     kerf_paths = loops_to_paths(kerf_loops)
     return kerf_paths
 
 
-def get_outside_kerf(tree, parameters):
-    """calculate kerf compensated path for visible surfaces"""
+def get_visible_hidden_kerf(original, processed, kerf_sizes, tolerance=FLATTEN_TOLERANCE,
+                            kerf_join=('round',)):
+    """returns {kerf size: (visible paths, hidden paths)} of a face's processed kerf,
+    each kerf size is offset once for the original and processed paths and
+    split into visible and hidden in a single pass"""
+    split_kerf = {}
+    for kerf_size in kerf_sizes:
+        if kerf_size not in split_kerf:
+            original_kerf = get_kerf(original, kerf_size, tolerance, kerf_join)
+            processed_kerf = get_kerf(processed, kerf_size, tolerance, kerf_join)
+            split_kerf[kerf_size] = split_overlapping(processed_kerf, original_kerf)
+    return split_kerf
+
+
+def get_visible_hidden(tree, parameters, layers=('Visible', 'Hidden')):
+    """calculate kerf compensated paths for visible (slow kerf) and
+    non-visible (fast kerf) surfaces, the kerf of each face is offset
+    and split once for every layer asked for"""
     slow_kerf_size = parameters['slow_kerf']
-    visible_style = f"fill:none;stroke:#ff0000;stroke-linejoin:round;" + \
-        f"stroke-width:{slow_kerf_size}px;stroke-linecap:round;stroke-opacity:0.5"
+    fast_kerf_size = parameters['fast_kerf']
+    layer_kerf = {
+        'Visible': (slow_kerf_size, 0, "#ff0000"),
+        'Hidden': (fast_kerf_size, 1, "#0000ff")}
+    kerf_sizes = tuple(layer_kerf[layer][0] for layer in layers)
+    tolerance = get_tolerance(parameters)
 
     for face, shapes in tree.items():
         if face.startswith('Face'):
-            original = shapes['Original']['paths']
-            processed = shapes['Processed']['paths']
-            original_kerf = get_kerf(original, parameters['slow_kerf'])
-            processed_kerf = get_kerf(processed, parameters['slow_kerf'])
-            outside_kerf = get_overlapping(processed_kerf, original_kerf)
-            # outside_kerf = intersect_paths(processed_kerf, original_kerf)
-            tree[face]['Visible'] = {
-                'paths': outside_kerf,
-                'style': visible_style}
+            split_kerf = get_visible_hidden_kerf(
+                shapes['Original']['paths'], shapes['Processed']['paths'],
+                kerf_sizes, tolerance, get_kerf_join(parameters, face))
+            for layer in layers:
+                kerf_size, side, color = layer_kerf[layer]
+                tree[face][layer] = {
+                    'paths': split_kerf[kerf_size][side],
+                    'style': f"fill:none;stroke:{color};stroke-linejoin:round;" +
+                             f"stroke-width:{kerf_size}px;stroke-linecap:round;" +
+                             "stroke-opacity:0.5"}
     return tree
 
 
+def get_outside_kerf(tree, parameters):
+    """calculate kerf compensated path for visible surfaces"""
+    return get_visible_hidden(tree, parameters, ('Visible',))
+
+
 def get_inside_kerf(tree, parameters):
     """calculate kerf compensated path for non-visible surfaces"""
-    fast_kerf_size = parameters['fast_kerf']
-    inside_style = f"fill:none;stroke:#0000ff;stroke-linejoin:round;" + \
-        f"stroke-width:{fast_kerf_size}px;stroke-linecap:round;stroke-opacity:0.5"
-
-    for face, shapes in tree.items():
-        if face.startswith('Face'):
-            original = shapes['Original']['paths']
-            processed = shapes['Processed']['paths']
-            original_kerf = get_kerf(original, parameters['fast_kerf'])
-            processed_kerf = get_kerf(processed, parameters['fast_kerf'])
-            # inside_kerf = subtract_paths(processed_kerf, original_kerf)
-            inside_kerf = get_not_overlapping(processed_kerf, original_kerf)
-            tree[face]['Hidden'] = {
-                'paths': inside_kerf,
-                'style': inside_style}
-    return tree
+    return get_visible_hidden(tree, parameters, ('Hidden',))
 
 
 def scale_viewbox(viewbox, scale):
@@ -797,6 +997,7 @@ def scale_joints(joints, scale):
     return scaled_joints
 
 
+@timed('scale')
 def scale_design(design_model, scale):
     """scales design by factor(float)"""
     scaled_model = design_model
@@ -807,12 +1008,16 @@ def scale_design(design_model, scale):
     return scaled_model
 
 
-def process_web_outputsvg(design_model, parameters):
-    """process joints and offset kerf"""
+def process_web_outputsvg(design_model, parameters, progress=None):
+    """process joints and offset kerf, progress(stage, done, total) is
+    called as each stage moves along"""
     # scaling
+    report_progress(progress, 'scale', 0, 1)
     scaled_model = scale_design(design_model, parameters['scaleFactor'])
+    report_progress(progress, 'scale', 1, 1)
     # Processing:
-    output_model = get_processed_model(scaled_model, parameters)
+    output_model = get_processed_model(scaled_model, parameters,
+                                       progress=progress)
     # Styling:
     output_model['attrib']['style'] = f"fill:none;stroke:#ff0000;stroke-linejoin:round;" + \
         f"stroke-width:0.1px;stroke-linecap:round;stroke-opacity:0.5"
@@ -820,46 +1025,44 @@ def process_web_outputsvg(design_model, parameters):
     return output_model
 
 
-def get_original_model(input_model):
+@timed('design')
+def get_original_model(input_model, tolerance=FLATTEN_TOLERANCE, workers=None):
     """process simple kerf offset"""
     output_model = make_blank_model(input_model['attrib'])
     # output_model['attrib'] = input_model['attrib']
     output_model['attrib']['style'] = "fill:#00ff00;fill-opacity:0.25;stroke:none"
-    output_model['tree'] = get_original_tree(input_model)
+    output_model['tree'] = get_original_tree(input_model, tolerance, workers)
     return output_model
 
 
+@timed('import')
 def svg_to_model(filename):
-    """converts svg file to design model"""
-    model = extract_embeded_model(filename)
+    """converts svg file (name or file object) to design model,
+    reading the file just once"""
+    model, svg_root = stream_svg(filename)
     if model is None:
-        model = model_from_raw_svg(filename)
+        model = model_from_svg_root(svg_root)
     return model
 
 
-def extract_embeded_model(filename):
-    """extracts embeded model if there is one in metadata"""
-    model = None
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    for metadata in root.findall('{http://www.w3.org/2000/svg}metadata'):
-        lasermetadata = metadata.find(
-            '{http://www.w3.org/2000/svg}laserassistant')
-        if lasermetadata is not None:
-            model = json.loads(lasermetadata.attrib['model'])
-    return model
+def svg_string_to_model(svg_string):
+    """converts svg text (eg. posted to the web app) to design model, in memory"""
+    if isinstance(svg_string, str):
+        svg_string = svg_string.encode("utf-8")
+    return svg_to_model(io.BytesIO(svg_string))
 
 
 def model_from_raw_svg(filename):
     """creates a new model from a raw svg file without metadata"""
-    svg_data = parse_svgfile(
-        filename)
+    return model_from_svg_root(read_svg(filename))
 
-    combined_path = svg_to_combined_paths(filename)
+
+def model_from_svg_root(svg_root):
+    """creates a new model from an already parsed svg without metadata"""
+    combined_path = element_to_combined_path(svg_root)
     closed_paths, open_paths = separate_closed_paths([combined_path])
     model = paths_to_faces(closed_paths)
-    model['attrib'] = svg_data['attrib']
+    model['attrib'] = root_attributes(svg_root)
     if open_paths != []:
         model['tree']['Open Paths'] = {'paths': open_paths}
     model['joints'] = {}
@@ -904,9 +1107,7 @@ def add_joints(model):
 
 def svg_to_combined_paths(filename):
     """converts svg file to a single combined path"""
-    paths, _ = SVGPT.svg2paths(filename)
-    combined_path = SVGPT.concatpaths(paths)
-    return combined_path.d()
+    return element_to_combined_path(read_svg(filename))
 
 
 def paths_to_faces(paths):
@@ -914,11 +1115,17 @@ def paths_to_faces(paths):
     model = make_blank_model()
     perims, cuts = separate_perims_from_cuts(paths)
 
+    cut_loops = [path_string_to_loop(cut) for cut in cuts]
+    cut_index = get_box_index([get_bounding_box(loop) for loop in cut_loops])
+
     for index, perim in enumerate(perims):
         model['tree'][f"face{index+1}"] = {
             "Perimeter": {'paths': [perim]}, "Cuts": {'paths': []}}
-        for cut in cuts:
-            if is_inside(cut, perim):
-                model['tree'][f"face{index+1}"]['Cuts']['paths'].append(cut)
+        perim_loop = path_string_to_loop(perim)
+        perim_box = get_bounding_box(perim_loop)
+        for cut_number in query_box_index(cut_index, perim_box):
+            if loop_inside_loop(cut_loops[cut_number], perim_loop):
+                model['tree'][f"face{index+1}"]['Cuts']['paths'].append(
+                    cuts[cut_number])
 
     return model
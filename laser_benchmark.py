@@ -0,0 +1,296 @@
+# laser_benchmark.py
+"""Benchmarks for the geometry behind laser_assistant
+
+run the pipeline benchmark on the samples plus synthetic designs with:
+    python laser_benchmark.py --output results.json
+"""
+
+import argparse
+import copy
+import glob
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import pyclipper
+
+from laser_clipper import merge_loops, get_union
+from laser_assistant import (svg_to_model, get_original_model,
+                             process_web_outputsvg, FACE_CACHE)
+from laser_path_utils import clear_path_cache
+from laser_svg_parser import model_to_svg_file
+
+SAMPLES = "input-samples/*.svg"
+LASER_PARAMETERS = {'thickness': 3.0, 'kerf': 0.05,
+                    'material': 'Wood', 'scaleFactor': 1.0}
+JOINT_TYPES = ['Box', 'Tab-and-Slot', 'Interlocking', 'Bolt', 'Divider', 'Flat']
+ALIGNMENTS = ['Inside', 'Middle', 'Outside']
+
+
+def square_loop(x_pos, y_pos, size):
+    """returns a square loop with its corner at (x, y)"""
+    return [[x_pos, y_pos], [x_pos + size, y_pos],
+            [x_pos + size, y_pos + size], [x_pos, y_pos + size]]
+
+
+def vent_grid(count, size=2.0, pitch=3.0):
+    """returns count square cut loops laid out in a grid,
+    like a vent or perforated panel"""
+    columns = max(1, int(count ** 0.5))
+    loops = []
+    for index in range(count):
+        row, column = divmod(index, columns)
+        loops.append(square_loop(column * pitch, row * pitch, size))
+    return loops
+
+
+def sequential_merge_loops(loops):
+    """reference: the old merge, one union per loop"""
+    if len(loops) < 1:
+        return loops
+    union = [loops[0]]
+    for loop in loops:
+        union = get_union(union, [loop])
+    return union
+
+
+def time_function(function, *args, repeat=3):
+    """returns the best wall time of function(*args) in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def area(loops):
+    """returns total signed area of a list of loops"""
+    return sum(pyclipper.Area(loop) for loop in loops)
+
+
+def benchmark_merge_loops(counts=(10, 100, 1000)):
+    """times merge_loops against the sequential union for growing cut counts"""
+    results = []
+    for count in counts:
+        loops = vent_grid(count)
+        merged = merge_loops(loops)
+        sequential = sequential_merge_loops(loops)
+        assert abs(area(merged) - area(sequential)) < 1e-6 * abs(area(merged)) + 1e-3
+        results.append({'loops': count,
+                        'merge_loops': time_function(merge_loops, loops),
+                        'sequential': time_function(sequential_merge_loops, loops)})
+    return results
+
+
+def joint_parameters(index):
+    """returns parameters of a joint, cycling through every joint type"""
+    return {'joint_type': JOINT_TYPES[index % len(JOINT_TYPES)],
+            'joint_align': ALIGNMENTS[index % len(ALIGNMENTS)],
+            'fit': 'Friction',
+            'tabsize': 5, 'tabspace': 5, 'tabnum': 2,
+            'boltsize': 'M3', 'boltspace': 5, 'boltnum': 1, 'boltlength': 10}
+
+
+def add_joints(model, count):
+    """joins up to count pairs of edges on different faces, like a user would"""
+    edges = model['edge_data']['edges']
+    model['joints'] = {}
+    pairs = [(edge_a, edge_b) for edge_a, edge_b in zip(edges, reversed(edges))
+             if edge_a['face'] != edge_b['face']]
+    for index, (edge_a, edge_b) in enumerate(pairs[:count]):
+        model['joints'][f"Joint{index + 1}"] = {
+            'edge_a': dict(edge_a), 'edge_b': dict(edge_b),
+            'joint_parameters': joint_parameters(index)}
+    model['joint_index'] = len(model['joints']) + 1
+    return model
+
+
+def synthetic_svg(faces, cuts=4, size=60.0, gap=10.0):
+    """returns svg text of a grid of square faces, each with a row of cuts"""
+    columns = max(1, int(faces ** 0.5))
+    shapes = []
+    for index in range(faces):
+        row, column = divmod(index, columns)
+        x_pos = column * (size + gap)
+        y_pos = row * (size + gap)
+        shapes.append(f'<rect x="{x_pos}" y="{y_pos}" width="{size}" height="{size}"/>')
+        pitch = size / (cuts + 1)
+        for cut in range(cuts):
+            shapes.append(f'<circle cx="{x_pos + pitch * (cut + 1)}" '
+                          f'cy="{y_pos + size / 2}" r="{pitch / 4}"/>')
+    width = columns * (size + gap)
+    height = (faces // columns + 1) * (size + gap)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}">'
+            + "".join(shapes) + '</svg>')
+
+
+def clear_caches():
+    """empties the path and face caches so every run starts cold"""
+    clear_path_cache()
+    FACE_CACHE.clear()
+
+
+def run_pipeline(filename, joints, parameters, output_dir):
+    """runs each stage once, returns {stage: seconds} and the output model size"""
+    timings = {}
+    stage_times = {}
+
+    def progress(stage, done, total):
+        """times the stages inside process_web_outputsvg"""
+        now = time.perf_counter()
+        if done == 0:
+            stage_times[stage] = now
+        if done == total and stage in stage_times:
+            timings[f"output.{stage}"] = now - stage_times[stage]
+
+    start = time.perf_counter()
+    model = add_joints(svg_to_model(filename), joints)
+    timings['svg_to_model'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_original_model(copy.deepcopy(model))
+    timings['get_original_model'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    output_model = process_web_outputsvg(copy.deepcopy(model), parameters,
+                                         progress=progress)
+    timings['process_web_outputsvg'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model_to_svg_file(output_model, design=model,
+                      filename=os.path.join(output_dir, "output.svg"))
+    timings['model_to_svg_file'] = time.perf_counter() - start
+
+    timings['total'] = sum(seconds for stage, seconds in timings.items()
+                           if '.' not in stage)
+    return timings, {'faces': len(output_model['tree']),
+                     'joints': len(model['joints']),
+                     'vertices': sum(output_model['vertices'].values())}
+
+
+def benchmark_design(filename, joints, parameters=None, repeat=3):
+    """best (cold cache) time of each stage, plus peak traced memory"""
+    if parameters is None:
+        parameters = LASER_PARAMETERS
+    result = {'design': filename}
+    with tempfile.TemporaryDirectory() as output_dir:
+        try:
+            best = {}
+            for _ in range(repeat):
+                clear_caches()
+                timings, counts = run_pipeline(filename, joints, parameters,
+                                               output_dir)
+                for stage, seconds in timings.items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+            # memory is measured on a separate run, tracing slows everything down
+            clear_caches()
+            tracemalloc.start()
+            run_pipeline(filename, joints, parameters, output_dir)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        except Exception as error:  # pylint: disable=broad-except
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            result['error'] = f"{type(error).__name__}: {error}"
+            return result
+    result.update(counts)
+    result['seconds'] = best
+    result['peak_memory'] = peak
+    return result
+
+
+def benchmark_synthetic(face_counts=(10, 60), joints_per_face=1, repeat=3,
+                        parameters=None):
+    """benchmarks scaled up designs of N faces with about N joints"""
+    results = []
+    with tempfile.TemporaryDirectory() as svg_dir:
+        for faces in face_counts:
+            filename = os.path.join(svg_dir, f"synthetic-{faces}.svg")
+            with open(filename, "w") as svg_file:
+                svg_file.write(synthetic_svg(faces))
+            result = benchmark_design(filename, faces * joints_per_face,
+                                      parameters, repeat)
+            result['design'] = f"synthetic-{faces}"
+            results.append(result)
+    return results
+
+
+def get_commit():
+    """returns the current git commit, if there is one"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_pipeline(samples=SAMPLES, joints=6, face_counts=(10, 60), repeat=3,
+                       parameters=None):
+    """benchmarks every sample and synthetic design, returns json-able results"""
+    if parameters is None:
+        parameters = LASER_PARAMETERS
+    results = [benchmark_design(filename, joints, parameters, repeat)
+               for filename in sorted(glob.glob(samples))]
+    results += benchmark_synthetic(face_counts, repeat=repeat, parameters=parameters)
+    return {'commit': get_commit(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+            'parameters': parameters,
+            'results': results}
+
+
+def print_results(results):
+    """prints a table of stage times (ms) and peak memory (MB)"""
+    stages = ['svg_to_model', 'get_original_model', 'process_web_outputsvg',
+              'model_to_svg_file', 'total']
+    print(f"{'design':<40}{'faces':>6}{'joints':>7}{'vertices':>9}" +
+          "".join(f"{stage[:12]:>14}" for stage in stages) + f"{'peak MB':>9}")
+    for result in results['results']:
+        name = os.path.basename(result['design'])[:39]
+        if 'error' in result:
+            print(f"{name:<40} {result['error']}")
+            continue
+        print(f"{name:<40}{result['faces']:>6}{result['joints']:>7}{result['vertices']:>9}" +
+              "".join(f"{result['seconds'][stage] * 1000:>14.1f}" for stage in stages) +
+              f"{result['peak_memory'] / 1e6:>9.1f}")
+
+
+def main():
+    """command line interface"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', default=SAMPLES,
+                        help="glob of svg files to benchmark")
+    parser.add_argument('--joints', type=int, default=6,
+                        help="joints added to each sample")
+    parser.add_argument('--faces', type=int, nargs='*', default=[10, 60],
+                        help="face counts of the synthetic designs")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--kerf-join', default='round',
+                        help="kerf offset corners: round, miter or square")
+    parser.add_argument('--output', help="save results as json to this file")
+    parser.add_argument('--merge', action='store_true',
+                        help="also benchmark merge_loops on vent grids")
+    args = parser.parse_args()
+
+    parameters = dict(LASER_PARAMETERS, kerf_join=args.kerf_join)
+    results = benchmark_pipeline(args.samples, args.joints, args.faces, args.repeat,
+                                 parameters)
+    if args.merge:
+        results['merge_loops'] = benchmark_merge_loops()
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
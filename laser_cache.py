@@ -0,0 +1,145 @@
+# laser_cache.py
+"""Content addressed cache for rendered results (eg. output svg bytes)"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# bump when a change to the joint/kerf code makes old results wrong,
+# so entries left in an on-disk cache are no longer found
+CACHE_VERSION = 1
+# bytes of results kept in memory
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+# files kept in the on-disk cache (when a directory is given)
+RESULT_CACHE_FILES = 1024
+
+
+def result_key(*parts):
+    """returns a canonical hash of json-able parts, eg. (kind, model, params),
+    that is the same however the dictionaries happen to be ordered"""
+    canonical = json.dumps([CACHE_VERSION, parts], sort_keys=True,
+                           separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """LRU cache of bytes by result key, bounded by total size in memory,
+    with an optional directory of files behind it"""
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, directory=None,
+                 max_files=RESULT_CACHE_FILES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_files = max_files
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """returns cached bytes for key, or None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_file(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, key, data):
+        """adds bytes to the cache, evicting the least recently used"""
+        with self._lock:
+            self._store(key, data)
+        self._write_file(key, data)
+
+    def get_or_render(self, key, render):
+        """returns cached bytes for key, calling render() to make them on a miss"""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def info(self):
+        """returns hit/miss counts and size of the cache"""
+        with self._lock:
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries),
+                    'bytes': self._size}
+
+    def clear(self):
+        """empties the in memory cache (files on disk are left alone)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _store(self, key, data):
+        """adds to memory (lock held), results too big to keep are skipped"""
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _file_path(self, key):
+        """returns the file a result is kept in on disk"""
+        return os.path.join(self.directory, f"{key}.cache")
+
+    def _read_file(self, key):
+        """reads a result from the disk tier, None if not there"""
+        if self.directory is None:
+            return None
+        try:
+            with open(self._file_path(key), "rb") as cache_file:
+                data = cache_file.read()
+        except OSError:
+            return None
+        # touch so pruning drops the least recently used files first
+        try:
+            os.utime(self._file_path(key))
+        except OSError:
+            pass
+        return data
+
+    def _write_file(self, key, data):
+        """writes a result to the disk tier, replacing it atomically"""
+        if self.directory is None:
+            return
+        handle, temp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_name, self._file_path(key))
+        self._prune_files()
+
+    def _prune_files(self):
+        """removes the oldest files once there are more than max_files"""
+        cache_files = [entry for entry in os.scandir(self.directory)
+                       if entry.name.endswith(".cache")]
+        if len(cache_files) <= self.max_files:
+            return
+        cache_files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in cache_files[:len(cache_files) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
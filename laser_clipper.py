@@ -5,99 +5,176 @@
 
 import pyclipper
 
+from laser_loop import Loop
+from laser_metrics import timed
+
 SCALING_FACTOR = 1000
 
+# join types for offsetting corners, see get_offset_loop
+JOIN_TYPES = {'round': pyclipper.JT_ROUND,
+              'miter': pyclipper.JT_MITER,
+              'square': pyclipper.JT_SQUARE}
+# how far (in multiples of the offset) a miter may stick out before it's squared off
+MITER_LIMIT = 2.0
+# max distance (mm) of round joins from a true arc, clipper's default of 0.25 units
+ARC_TOLERANCE = 0.25 / SCALING_FACTOR
+
+
+def loop_to_clipper(loop):
+    """scales a Loop (one vectorized multiply) or list of points into clipper units"""
+    if isinstance(loop, Loop):
+        return loop.to_clipper(SCALING_FACTOR)
+    return pyclipper.scale_to_clipper(loop, SCALING_FACTOR)
+
+
+def loops_to_clipper(loops):
+    """scales a list of loops into clipper integer units"""
+    return [loop_to_clipper(loop) for loop in loops]
+
 
-def merge_loops(loops):
-    """merges multiple loops into a union"""
+def loops_from_clipper(scaled_loops):
+    """scales a list of clipper integer loops back into Loops"""
+    return [Loop.from_clipper(loop, SCALING_FACTOR) for loop in scaled_loops]
+
+
+@timed('clipper.merge')
+def merge_loops(loops, fill_type=pyclipper.PFT_NONZERO):
+    """merges multiple loops into a union with a single clipper execution"""
     if len(loops) < 1:
         return (loops)
-    union = [loops[0]]
-    for loopindex in range(len(loops)):
-        union = get_union(union, [loops[loopindex]])
+    scaled_loops = loops_to_clipper(loops)
+    scaled_union = simplify_loops(scaled_loops, fill_type)
+    union = loops_from_clipper(scaled_union)
     return union
 
 
+@timed('clipper.difference')
 def get_difference(first, second):
-    """Takes two list of loops (list of (x,y) points), and returns the difference"""
-    second = merge_loops(second)
-    if second == []:
+    """Takes two list of loops (Loops or lists of (x,y) points), and returns the difference"""
+    scaled_second = loops_to_clipper(second)
+    scaled_second = simplify_loops(scaled_second)
+    if scaled_second == []:
         return first
 
     clipper = pyclipper.Pyclipper()
-    scaled_first = pyclipper.scale_to_clipper(first, SCALING_FACTOR)
-    scaled_second = pyclipper.scale_to_clipper(second, SCALING_FACTOR)
+    scaled_first = loops_to_clipper(first)
 
     clipper.AddPaths(scaled_first, pyclipper.PT_SUBJECT)
     clipper.AddPaths(scaled_second, pyclipper.PT_CLIP)
     scaled_difference = clipper.Execute(pyclipper.CT_DIFFERENCE)
 
-    difference = pyclipper.scale_from_clipper(
-        scaled_difference, SCALING_FACTOR)
+    difference = loops_from_clipper(scaled_difference)
     return difference
 
 
+@timed('clipper.simplify')
+def simplify_loops(scaled_loops, fill_type=pyclipper.PFT_NONZERO):
+    """returns the union of scaled loops as clean simple loops, each loop is
+    filled even-odd on its own (like get_union) before they are combined
+    with fill_type"""
+    simple_loops = []
+    for loop in scaled_loops:
+        simple_loops += pyclipper.SimplifyPolygon(loop, pyclipper.PFT_EVENODD)
+    return pyclipper.SimplifyPolygons(simple_loops, fill_type)
+
+
+@timed('clipper.joined_difference')
+def get_joined_difference(shape, additions, subtractions):
+    """Takes three lists of loops and returns (shape + additions) - subtractions,
+    running one union and one difference without leaving clipper units"""
+    scaled_shape = loops_to_clipper(shape)
+
+    if additions:
+        clipper = pyclipper.Pyclipper()  # pylint: disable=c-extension-no-member
+        scaled_additions = loops_to_clipper(additions)
+        clipper.AddPaths(scaled_shape, pyclipper.PT_SUBJECT)
+        clipper.AddPaths(simplify_loops(scaled_additions), pyclipper.PT_CLIP)
+        scaled_shape = clipper.Execute(pyclipper.CT_UNION,
+                                       pyclipper.PFT_EVENODD,
+                                       pyclipper.PFT_NONZERO)
+
+    if subtractions:
+        clipper = pyclipper.Pyclipper()  # pylint: disable=c-extension-no-member
+        scaled_subtractions = loops_to_clipper(subtractions)
+        clipper.AddPaths(scaled_shape, pyclipper.PT_SUBJECT)
+        clipper.AddPaths(simplify_loops(scaled_subtractions),
+                         pyclipper.PT_CLIP)
+        scaled_shape = clipper.Execute(pyclipper.CT_DIFFERENCE,
+                                       pyclipper.PFT_EVENODD,
+                                       pyclipper.PFT_NONZERO)
+        # cuts share edges with the perimeter, which can leave zero width
+        # slivers joining separate pieces, simplifying splits them apart
+        scaled_shape = pyclipper.SimplifyPolygons(scaled_shape,
+                                                  pyclipper.PFT_NONZERO)
+
+    joined_difference = loops_from_clipper(scaled_shape)
+    return joined_difference
+
+
+@timed('clipper.intersection')
 def get_intersection(first, second):
     """Takes two list of loops(list of(x, y) points), and returns the intersection"""
     clipper = pyclipper.Pyclipper()  # pylint: disable=c-extension-no-member
-    scaled_first = pyclipper.scale_to_clipper(first, SCALING_FACTOR)
-    scaled_second = pyclipper.scale_to_clipper(second, SCALING_FACTOR)
+    scaled_first = loops_to_clipper(first)
+    scaled_second = loops_to_clipper(second)
 
     clipper.AddPaths(scaled_first, pyclipper.PT_SUBJECT)
     clipper.AddPaths(scaled_second, pyclipper.PT_CLIP)
     scaled_intersection = clipper.Execute(pyclipper.CT_INTERSECTION)
 
-    intersection = pyclipper.scale_from_clipper(
-        scaled_intersection, SCALING_FACTOR)
+    intersection = loops_from_clipper(scaled_intersection)
     return intersection
 
 
+@timed('clipper.union')
 def get_union(first, second):
     """Takes two list of loops(list of(x, y) points), and returns the union"""
     clipper = pyclipper.Pyclipper()  # pylint: disable=c-extension-no-member
-    scaled_first = pyclipper.scale_to_clipper(first, SCALING_FACTOR)
-    scaled_second = pyclipper.scale_to_clipper(second, SCALING_FACTOR)
+    scaled_first = loops_to_clipper(first)
+    scaled_second = loops_to_clipper(second)
 
     clipper.AddPaths(scaled_first, pyclipper.PT_SUBJECT)
     clipper.AddPaths(scaled_second, pyclipper.PT_CLIP)
     scaled_union = clipper.Execute(pyclipper.CT_UNION)
 
-    union = pyclipper.scale_from_clipper(
-        scaled_union, SCALING_FACTOR)
+    union = loops_from_clipper(scaled_union)
     return union
 
 
+@timed('clipper.xor')
 def get_xor(first, second):
     """Takes two list of loops(list of(x, y) points), and returns the exclusive-or"""
     clipper = pyclipper.Pyclipper()  # pylint: disable=c-extension-no-member
-    scaled_first = pyclipper.scale_to_clipper(first, SCALING_FACTOR)
-    scaled_second = pyclipper.scale_to_clipper(second, SCALING_FACTOR)
+    scaled_first = loops_to_clipper(first)
+    scaled_second = loops_to_clipper(second)
 
     clipper.AddPaths(scaled_first, pyclipper.PT_SUBJECT)
     clipper.AddPaths(scaled_second, pyclipper.PT_CLIP)
     scaled_xor = clipper.Execute(pyclipper.CT_XOR)
 
-    xor = pyclipper.scale_from_clipper(
-        scaled_xor, SCALING_FACTOR)
+    xor = loops_from_clipper(scaled_xor)
     return xor
 
 
-def get_offset_loop(shape, offset_size):
-    """takes a list of loops (list of(x, y) points), and returns loops offset by a given size"""
-    offsetter = pyclipper.PyclipperOffset()
-    scaled_shape = pyclipper.scale_to_clipper(shape, SCALING_FACTOR)
+@timed('clipper.offset')
+def get_offset_loop(shape, offset_size, join_type='round',
+                    miter_limit=MITER_LIMIT, arc_tolerance=ARC_TOLERANCE):
+    """takes a list of loops (list of(x, y) points), and returns loops offset by a given size,
+    corners are joined 'round' (within arc_tolerance mm), 'miter' (up to miter_limit) or 'square'"""
+    offsetter = pyclipper.PyclipperOffset(miter_limit, arc_tolerance * SCALING_FACTOR)
+    scaled_shape = loops_to_clipper(shape)
     scaled_offset_size = offset_size * SCALING_FACTOR
 
-    offsetter.AddPaths(scaled_shape, pyclipper.JT_ROUND, pyclipper.PT_SUBJECT)
+    offsetter.AddPaths(scaled_shape, JOIN_TYPES[join_type], pyclipper.PT_SUBJECT)
     scaled_offset = offsetter.Execute(scaled_offset_size)
 
-    offset = pyclipper.scale_from_clipper(scaled_offset, SCALING_FACTOR)
+    offset = loops_from_clipper(scaled_offset)
     return offset
 
 
 def point_inside_loop(point, loop):
     """tests to see if a point is inside (1), on(-1), or outside (0) of a loop"""
-    scaled_loop = pyclipper.scale_to_clipper(loop, SCALING_FACTOR)
+    scaled_loop = loop_to_clipper(loop)
     scaled_point = [int(point[0] * SCALING_FACTOR),
                     int(point[1] * SCALING_FACTOR)]
     is_point_inside = pyclipper.PointInPolygon(scaled_point, scaled_loop)
@@ -110,3 +187,15 @@ def point_on_loops(point, loops):
         if point_inside_loop(point, loop) == -1:
             return True
     return False
+
+
+@timed('clipper.inside')
+def loop_inside_loop(loop, other_loop):
+    """True if any point of loop is inside (not on) other_loop,
+    other_loop is only scaled once for all of the points"""
+    scaled_other_loop = loop_to_clipper(other_loop)
+    scaled_points = loop_to_clipper(loop)
+    for scaled_point in scaled_points:
+        if pyclipper.PointInPolygon(scaled_point, scaled_other_loop) == 1:
+            return True
+    return False
@@ -1,14 +1,24 @@
 """Flask server to host UI"""
 
+import copy
 import json
+import os
 
 from flask_cors import CORS
 
 from flask import Flask, request, redirect, jsonify
 
-from laser_assistant import (svg_to_model,
-                             get_original_model, process_web_outputsvg)
-from laser_svg_parser import model_to_svg_file
+from laser_assistant import (svg_string_to_model, report_progress,
+                             get_original_model, process_web_outputsvg,
+                             FACE_CACHE)
+from laser_path_utils import path_cache_info
+from laser_svg_parser import model_to_svg_string
+from laser_cache import ResultCache, result_key
+from laser_jobs import JobQueue
+from laser_metrics import METRICS_ENABLED, collect, server_timing, snapshot
+from laser_profiler import SlowRequestProfiler
+from laser_sessions import SessionStore
+from laser_http import compressed_response, COMPRESSED_CACHE
 
 # tell flask to host the front end
 VUE_STATIC = "./laser_frontend/dist/"
@@ -21,6 +31,19 @@ VUE_CLIENT = {"origins": "*"}
 app.config['CORS_HEADERS'] = 'Content-Type'
 cors = CORS(app, resources={r"*": VUE_CLIENT})  # pylint: disable=invalid-name
 
+# rendered svgs by hash of the posted model + parameters,
+# set LASER_CACHE_DIR to also keep them on disk between restarts
+RESULT_CACHE = ResultCache(directory=os.environ.get('LASER_CACHE_DIR'))
+
+# background renders for the /jobs api
+JOB_QUEUE = JobQueue()
+
+# set LASER_PROFILE_DIR to keep profiles + inputs of slow requests
+PROFILER = SlowRequestProfiler()
+
+# designs uploaded once and then edited with json-patch deltas
+SESSIONS = SessionStore()
+
 
 @app.route('/')
 def main_interface():
@@ -29,51 +52,201 @@ def main_interface():
     return redirect('index.html')
 
 
-@app.route('/get_design', methods=['GET', 'POST'])
+@app.route('/get_design', methods=['POST'])
 def get_design():
-    """returns design.svg"""
-    if request.method == 'POST':
-        model = json.loads(request.form['inputModel'])
-        # params = json.loads(request.form['laserParams'])
-        new_model = get_original_model(model)
-        model_to_svg_file(new_model, design=model, filename="design.svg")
-    return get_svg_response('design.svg')
+    """returns design svg of the posted model"""
+    model = json.loads(request.form['inputModel'])
+    # params = json.loads(request.form['laserParams'])
+    return svg_response(render_design(model))
 
 
-@app.route('/get_output', methods=['GET', 'POST'])
+@app.route('/get_output', methods=['POST'])
 def get_output():
-    """returns output.svg"""
-    if request.method == 'POST':
-        model = json.loads(request.form['inputModel'])
+    """returns output svg of the posted model and laser parameters"""
+    model = json.loads(request.form['inputModel'])
+    params = json.loads(request.form['laserParams'])
+    return output_response(model, params, request.form.to_dict())
+
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """stores the posted model (and laser parameters, if any) for later edits"""
+    model = json.loads(request.form['inputModel'])
+    params = None
+    if 'laserParams' in request.form:
         params = json.loads(request.form['laserParams'])
-        new_model = process_web_outputsvg(model, params)
-        model_to_svg_file(new_model, design=model)
-    return get_svg_response('output.svg')
+    session_id = SESSIONS.create(model, params)
+    return jsonify({'id': session_id, 'version': 0}), 201
+
+
+@app.route('/sessions/<session_id>', methods=['PATCH'])
+def patch_session(session_id):
+    """applies a json-patch (the json body, or form field 'patch') to a session"""
+    operations = request.get_json(silent=True)
+    if operations is None:
+        if 'patch' not in request.form:
+            return jsonify({'error': "send the patch as a json body or a 'patch' field"}), 400
+        try:
+            operations = json.loads(request.form['patch'])
+        except ValueError as error:
+            return jsonify({'error': f"malformed patch: {error}"}), 400
+    try:
+        version = SESSIONS.update(session_id, operations)
+    except KeyError:
+        return jsonify({'error': "unknown session"}), 404
+    except ValueError as error:
+        return jsonify({'error': f"bad patch: {error}"}), 400
+    return jsonify({'id': session_id, 'version': version})
+
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """forgets a session"""
+    if not SESSIONS.delete(session_id):
+        return jsonify({'error': "unknown session"}), 404
+    return jsonify({'id': session_id})
+
+
+@app.route('/sessions/<session_id>/design', methods=['GET'])
+def session_design(session_id):
+    """returns design svg of a session's model"""
+    session = SESSIONS.get(session_id)
+    if session is None:
+        return jsonify({'error': "unknown session"}), 404
+    document, _ = session
+    return svg_response(render_design(document['model']))
+
+
+@app.route('/sessions/<session_id>/output', methods=['GET'])
+def session_output(session_id):
+    """returns output svg of a session's model and laser parameters"""
+    session = SESSIONS.get(session_id)
+    if session is None:
+        return jsonify({'error': "unknown session"}), 404
+    document, _ = session
+    if document.get('params') is None:
+        return jsonify({'error': "session has no laser parameters"}), 400
+    # the model is only serialized again if the render turns out slow
+    def inputs():
+        return {'inputModel': json.dumps(document['model']),
+                'laserParams': json.dumps(document['params'])}
+    return output_response(document['model'], document['params'], inputs)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """returns stage timings and counters (when LASER_METRICS=1) and cache stats"""
+    report = snapshot()
+    report['caches'] = {'results': RESULT_CACHE.info(),
+                        'faces': FACE_CACHE.info(),
+                        'compressed': COMPRESSED_CACHE.info(),
+                        'paths': path_cache_info()}
+    return jsonify(report)
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """queues a 'design' or 'output' (default) render, returns the job id"""
+    kind = request.form.get('kind', 'output')
+    model = json.loads(request.form['inputModel'])
+    if kind == 'design':
+        job_id = JOB_QUEUE.submit(render_design, model)
+    elif kind == 'output':
+        params = json.loads(request.form['laserParams'])
+        job_id = JOB_QUEUE.submit(render_output, model, params)
+    else:
+        return jsonify({'error': f"unknown job kind {kind}"}), 400
+    return jsonify({'id': job_id}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """returns state and per-stage progress of a job"""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({'error': "unknown job"}), 404
+    return jsonify(job.status())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """returns the svg a job made, or its status while it isn't done"""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({'error': "unknown job"}), 404
+    status = job.status()
+    if status['state'] == 'failed':
+        return jsonify(status), 500
+    if status['state'] != 'done':
+        return jsonify(status), 202
+    return svg_response(job.result)
 
 
 @app.route('/get_model', methods=['POST'])
 def get_model():
     """returns json model of svg posted"""
     svg_input = request.form['svgInput']
-    svg_file = open("input.svg", "w")
-    svg_file.write(svg_input)
-    svg_file.close()
-    model = svg_to_model('input.svg')
-    return jsonify(model)
-
-
-def get_svg_response(filename):
-    """returns a response with svg file"""
-    svgfile = open(filename, "r")
-    svgdata = svgfile.read()
-    svgfile.close()
-    response = app.response_class(
-        response=svgdata,
-        status=200,
-        mimetype='image/svg+xml'
-    )
+    try:
+        model = PROFILER.run('get_model', request.form.to_dict(),
+                             svg_string_to_model, svg_input)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    return compressed_response(json.dumps(model).encode("utf-8"), 'application/json')
+
+
+def output_response(model, params, inputs):
+    """renders output svg, profiled if slow and with Server-Timing when measured,
+    inputs are the request input (or a function returning it) kept with a profile"""
+    with collect() as request_metrics:
+        try:
+            svgdata = PROFILER.run('get_output', inputs,
+                                   render_output, model, params)
+        except ValueError as error:
+            # bad laser parameters, eg. a tolerance of 0
+            return jsonify({'error': str(error)}), 400
+        response = svg_response(svgdata)
+    # a cached result has no stages to report
+    if METRICS_ENABLED and request_metrics['timings']:
+        response.headers['Server-Timing'] = server_timing(request_metrics)
     return response
 
 
+def render_design(model, progress=None):
+    """returns design svg (bytes) of a model, cached,
+    the model passed in is left unchanged (sessions keep it)"""
+    key = result_key('design', model)
+
+    def render():
+        design = copy.deepcopy(model)
+        new_model = get_original_model(design)
+        report_progress(progress, 'render', 0, 1)
+        svgdata = model_to_svg_string(new_model, design=design).encode("utf-8")
+        report_progress(progress, 'render', 1, 1)
+        return svgdata
+
+    return RESULT_CACHE.get_or_render(key, render)
+
+
+def render_output(model, params, progress=None):
+    """returns output svg (bytes) of a model and laser parameters, cached,
+    the model passed in is left unchanged (sessions keep it)"""
+    key = result_key('output', model, params)
+
+    def render():
+        design = copy.deepcopy(model)
+        new_model = process_web_outputsvg(design, params, progress=progress)
+        report_progress(progress, 'render', 0, 1)
+        svgdata = model_to_svg_string(new_model, design=design).encode("utf-8")
+        report_progress(progress, 'render', 1, 1)
+        return svgdata
+
+    return RESULT_CACHE.get_or_render(key, render)
+
+
+def svg_response(svgdata):
+    """returns a response with svg data, compressed and with an ETag"""
+    return compressed_response(svgdata, 'image/svg+xml')
+
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,89 @@
+# laser_http.py
+"""Compressed, conditional responses for the flask servers
+
+Responses carry a strong ETag of their content (one per content encoding)
+and are compressed with brotli (when the package is installed) or gzip if
+the client accepts it. A GET (or HEAD) whose If-None-Match holds the ETag
+gets an empty 304 instead.
+"""
+
+import gzip
+import hashlib
+
+from flask import current_app, request
+
+from laser_cache import ResultCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always there
+    brotli = None
+
+# smaller bodies aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# only these methods may be answered with 304 Not Modified
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+# compressed bodies by ETag, so popular outputs are only compressed once
+COMPRESSED_CACHE = ResultCache(max_bytes=32 * 1024 * 1024)
+
+
+def content_etag(data):
+    """returns a strong entity tag (without quotes) of response bytes"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def supported_encodings():
+    """returns content codings this server can send, most preferred first"""
+    if brotli is not None:
+        return ['br', 'gzip']
+    return ['gzip']
+
+
+def choose_encoding(accept_encodings, size):
+    """returns the coding to send ('br' or 'gzip'), None to send as is"""
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    chosen = None
+    best_quality = 0
+    for encoding in supported_encodings():
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            chosen = encoding
+            best_quality = quality
+    return chosen
+
+
+def compress(data, encoding):
+    """returns data compressed with a content coding"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 so the same input always makes the same bytes
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compressed_response(data, mimetype):
+    """returns a response of data (bytes) for the current request,
+    compressed if accepted and 304 if a GET/HEAD client already has it"""
+    encoding = choose_encoding(request.accept_encodings, len(data))
+    etag = content_etag(data)
+    if encoding is not None:
+        etag = f"{etag}-{encoding}"
+
+    if request.method in CONDITIONAL_METHODS and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        body = data
+        if encoding is not None:
+            body = COMPRESSED_CACHE.get_or_render(
+                etag, lambda: compress(data, encoding))
+        response = current_app.response_class(response=body, status=200,
+                                              mimetype=mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # may be stored, but has to be checked with the server (cheap with a 304)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
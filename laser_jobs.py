@@ -0,0 +1,106 @@
+# laser_jobs.py
+"""In-process queue of background jobs with per-stage progress"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# jobs run at the same time, the geometry itself can still fan out to the
+# face process pool (see laser_assistant.map_faces)
+JOB_WORKERS = 2
+# finished jobs remembered for status/result requests, oldest dropped first
+JOB_HISTORY = 100
+
+
+class Job:
+    """state of one queued job: queued -> running -> done (or failed)"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.state = 'queued'
+        self.stage = None
+        self.stages = OrderedDict()
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def progress(self, stage, done, total):
+        """records how far along a stage is (pass as the progress callback)"""
+        with self._lock:
+            self.stage = stage
+            self.stages[stage] = {'done': done, 'total': total}
+
+    def start(self):
+        """marks the job as running"""
+        with self._lock:
+            self.state = 'running'
+            self.started = time.time()
+
+    def finish(self, result=None, error=None):
+        """marks the job as done with a result, or failed with an error"""
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.state = 'done' if error is None else 'failed'
+            self.finished = time.time()
+
+    def status(self):
+        """returns the job state as a json-able dict"""
+        with self._lock:
+            status = {'id': self.id,
+                      'state': self.state,
+                      'stage': self.stage,
+                      'stages': {stage: dict(counts)
+                                 for stage, counts in self.stages.items()},
+                      'submitted': self.submitted,
+                      'started': self.started,
+                      'finished': self.finished}
+            if self.error is not None:
+                status['error'] = self.error
+            return status
+
+
+class JobQueue:
+    """runs submitted functions on a thread pool and keeps track of them"""
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """queues function(*args, progress=job.progress), returns the job id"""
+        job = Job()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job, function, args)
+        return job.id
+
+    def get(self, job_id):
+        """returns the job with this id, or None if unknown (or forgotten)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, function, args):
+        """runs a job and stores its result or error"""
+        job.start()
+        try:
+            result = function(*args, progress=job.progress)
+        except Exception as error:  # pylint: disable=broad-except
+            job.finish(error=f"{type(error).__name__}: {error}")
+        else:
+            job.finish(result=result)
+
+    def _forget_finished(self):
+        """drops the oldest finished jobs beyond the history limit (lock held)"""
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.state in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,77 @@
+# laser_loop.py
+"""Compact loop of points for laser cutting geometry"""
+
+import numpy as np
+
+
+class Loop:
+    """A loop of (x, y) points stored in one contiguous (n, 2) NumPy array.
+    Iterating or indexing gives [x, y] lists, so a Loop can be used anywhere
+    a list of points is expected."""
+
+    __slots__ = ('points', 'closed', '_bbox', '_area')
+
+    def __init__(self, points, closed=True):
+        self.points = np.ascontiguousarray(points, dtype=float).reshape(-1, 2)
+        self.closed = closed
+        self._bbox = None
+        self._area = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points.tolist())
+
+    def __getitem__(self, index):
+        return self.points[index].tolist()
+
+    def __repr__(self):
+        return f"Loop({self.points.tolist()}, closed={self.closed})"
+
+    @property
+    def bbox(self):
+        """bounding box (min x, min y, max x, max y)"""
+        if self._bbox is None:
+            minimum = self.points.min(axis=0)
+            maximum = self.points.max(axis=0)
+            self._bbox = (float(minimum[0]), float(minimum[1]),
+                          float(maximum[0]), float(maximum[1]))
+        return self._bbox
+
+    @property
+    def area(self):
+        """signed area (shoelace), positive when wound like a clipper outer loop"""
+        if self._area is None:
+            x_values = self.points[:, 0]
+            y_values = self.points[:, 1]
+            self._area = float(np.dot(x_values, np.roll(y_values, -1)) -
+                               np.dot(y_values, np.roll(x_values, -1))) / 2.0
+        return self._area
+
+    @property
+    def orientation(self):
+        """True for positive winding, matches pyclipper.Orientation"""
+        return self.area >= 0
+
+    def freeze(self):
+        """makes the point array read only so the loop can be shared (eg. cached)"""
+        self.points.flags.writeable = False
+        return self
+
+    def to_clipper(self, scale):
+        """returns points as clipper integers (truncated like pyclipper.scale_to_clipper),
+        handed over as a list since pyclipper reads lists much faster than arrays"""
+        return (self.points * scale).astype(np.int64).tolist()
+
+    @classmethod
+    def from_clipper(cls, scaled_points, scale):
+        """makes a loop from clipper integer points"""
+        return cls(np.asarray(scaled_points, dtype=np.int64) / scale)
+
+
+def as_loop(points):
+    """returns points as a Loop, without copying if it already is one"""
+    if isinstance(points, Loop):
+        return points
+    return Loop(points)
@@ -0,0 +1,107 @@
+# laser_metrics.py
+"""Timings and counters for each stage of the pipeline
+
+Turned on by setting LASER_METRICS=1 before starting. When off, timed()
+hands back the undecorated function, so there is next to no overhead.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+METRICS_ENABLED = os.environ.get('LASER_METRICS', '0') not in ('', '0')
+
+_TOTALS = {'timings': {}, 'counters': {}}
+_LOCK = threading.Lock()
+# metrics of the request (or other block) being collected in this context
+_COLLECTOR = ContextVar('laser_metrics_collector', default=None)
+
+
+def new_metrics():
+    """returns an empty set of metrics"""
+    return {'timings': {}, 'counters': {}}
+
+
+def _add_timing(metrics, name, seconds):
+    """adds one timing to a metrics dict"""
+    timing = metrics['timings'].get(name)
+    if timing is None:
+        metrics['timings'][name] = {'count': 1, 'seconds': seconds, 'max': seconds}
+    else:
+        timing['count'] += 1
+        timing['seconds'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+
+def record(name, seconds):
+    """adds a timing of a stage"""
+    with _LOCK:
+        _add_timing(_TOTALS, name, seconds)
+    collected = _COLLECTOR.get()
+    if collected is not None:
+        _add_timing(collected, name, seconds)
+
+
+def count(name, amount=1):
+    """adds to a counter (eg. cache hits or vertices made)"""
+    if not METRICS_ENABLED:
+        return
+    with _LOCK:
+        _TOTALS['counters'][name] = _TOTALS['counters'].get(name, 0) + amount
+    collected = _COLLECTOR.get()
+    if collected is not None:
+        collected['counters'][name] = collected['counters'].get(name, 0) + amount
+
+
+def timed(name):
+    """decorator that times every call of a function as a stage"""
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return timed_function
+    return decorator
+
+
+@contextmanager
+def collect():
+    """gathers the metrics recorded inside the block (in this thread/context),
+    yields a metrics dict that is filled in as the block runs"""
+    collected = new_metrics()
+    token = _COLLECTOR.set(collected)
+    try:
+        yield collected
+    finally:
+        _COLLECTOR.reset(token)
+
+
+def snapshot():
+    """returns a copy of all metrics recorded since start (or reset)"""
+    with _LOCK:
+        return {'enabled': METRICS_ENABLED,
+                'timings': {name: dict(timing)
+                            for name, timing in _TOTALS['timings'].items()},
+                'counters': dict(_TOTALS['counters'])}
+
+
+def reset():
+    """clears all recorded metrics"""
+    with _LOCK:
+        _TOTALS['timings'].clear()
+        _TOTALS['counters'].clear()
+
+
+def server_timing(metrics):
+    """formats timings as a Server-Timing header value (durations in ms)"""
+    return ", ".join(f"{name};dur={timing['seconds'] * 1000:.1f}"
+                     for name, timing in metrics['timings'].items())
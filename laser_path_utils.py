@@ -1,53 +1,172 @@
 # laser_path_utils.py
 """Utility functions for working with paths for laser cutting"""
 
+from functools import lru_cache
+
 import numpy as np
 
 import svgpathtools.svgpathtools as SVGPT
 # it's imporatant to clone and install the repo manually. The pip/pypi version is outdated
 
-from laser_svg_utils import tree_to_tempfile
-from laser_clipper import point_on_loops, point_inside_loop
+from laser_clipper import loop_inside_loop, loop_to_clipper, SCALING_FACTOR
+from laser_loop import Loop, as_loop
+from laser_metrics import timed, count
 
+# number of unique path strings kept parsed between calls
+PATH_CACHE_SIZE = 4096
 
-def tempfile_to_paths(temp_svg):
-    """open temp SVG file and return a path"""
-    # temp_svg.seek(0)
-    paths, attributes = SVGPT.svg2paths(temp_svg.name)
-    temp_svg.close()
-    return (paths, attributes)
+# max distance (mm) between a curve and the straight lines that replace it,
+# can be overridden with 'tolerance' in the laser parameters
+FLATTEN_TOLERANCE = 0.01
+# smallest tolerance used, finer ones are raised to this
+MIN_FLATTEN_TOLERANCE = 1e-4
+# limit on straight lines per curve, so a tiny tolerance can't explode a path
+MAX_CURVE_SEGMENTS = 1000
+# shape kinds in the order they are combined into one path on import
+COMBINED_SHAPE_ORDER = ('path', 'polyline', 'polygon', 'line', 'ellipse', 'circle', 'rect')
 
 
-def tree_to_paths(tree):
-    """turns an svg tree into paths list"""
-    temp_svg = tree_to_tempfile(tree)
-    paths, _ = tempfile_to_paths(temp_svg)
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+@timed('path.parse')
+def parse_path(path_string):
+    """parses a path string into a Path object, cached by path string
+    (the returned Path is shared, so treat it as read only)"""
+    return SVGPT.parse_path(path_string)
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def _path_length(path_string):
+    """cached length of a path string"""
+    return parse_path(path_string).length()
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def _path_start(path_string):
+    """cached start point of a path string as a tuple"""
+    start = parse_path(path_string).start
+    return (start.real, start.imag)
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def _path_angle(path_string):
+    """cached angle of a path string in degrees"""
+    path = parse_path(path_string)
+    vector = path.point(1) - path.point(0)
+    return np.angle(vector, deg=True)
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+@timed('path.flatten')
+def _path_points(path_string, tolerance=FLATTEN_TOLERANCE):
+    """cached sampled points of a path string as a read only Loop"""
+    path = parse_path(path_string)
+
+    empty = SVGPT.Path()
+    if path == empty:
+        return None
+    points = []
+    for segment in path:
+        segment_points = subpath_to_points(segment, tolerance)
+        for point in segment_points:
+            if points == [] or point != points[-1]:
+                points.append(point)
+    count('path.vertices', len(points))
+    return Loop(points).freeze()
+
+
+PATH_CACHES = {'parse': parse_path,
+               'length': _path_length,
+               'start': _path_start,
+               'angle': _path_angle,
+               'points': _path_points}
+
+
+def path_cache_info():
+    """returns hits, misses and size of each parsed path cache"""
+    info = {}
+    for name, cached_function in PATH_CACHES.items():
+        info[name] = cached_function.cache_info()._asdict()
+    return info
+
+
+def clear_path_cache():
+    """empties all of the parsed path caches"""
+    for cached_function in PATH_CACHES.values():
+        cached_function.cache_clear()
+
+
+def get_tag_name(element):
+    """returns element tag without the namespace, eg. 'rect'"""
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def line_to_path_string(line):
+    """converts line attributes (x1, y1, x2, y2) into a path string"""
+    return f"M {line.get('x1', '0')} {line.get('y1', '0')} " + \
+        f"L {line.get('x2', '0')} {line.get('y2', '0')}"
+
+
+def element_to_path_string(element):
+    """converts a single svg shape element into a path string (None if not a shape)"""
+    shape_converters = {
+        'path': SVGPT.svg_to_paths.path2pathd,
+        'rect': SVGPT.svg_to_paths.rect2pathd,
+        'line': line_to_path_string,
+        'circle': SVGPT.svg_to_paths.ellipse2pathd,
+        'ellipse': SVGPT.svg_to_paths.ellipse2pathd,
+        'polyline': SVGPT.svg_to_paths.polyline2pathd,
+        'polygon': SVGPT.svg_to_paths.polygon2pathd}
+    converter = shape_converters.get(get_tag_name(element))
+    if converter is None:
+        return None
+    return converter(element.attrib)
+
+
+def element_to_paths(element):
+    """turns an svg element (and any shapes inside it) into paths list, in memory"""
     svg_paths = []
-    for path in paths:
-        if not path:
-            svg_paths.append(path.d())
+    for shape in element.iter():
+        path_string = element_to_path_string(shape)
+        if path_string is not None:
+            path = parse_path(path_string)
+            if path:
+                svg_paths.append(path.d())
     return svg_paths
 
 
-def paths_to_loops(paths):
-    """"Convert a list of paths to a list of points"""
+def element_to_combined_path(element):
+    """turns every shape in an svg element into one combined path string,
+    shapes taken kind by kind in the same order as svgpathtools.svg2paths"""
+    shapes = {tag: [] for tag in COMBINED_SHAPE_ORDER}
+    for shape in element.iter():
+        tag = get_tag_name(shape)
+        if tag in shapes:
+            shapes[tag].append(shape)
+    segments = []
+    for tag in COMBINED_SHAPE_ORDER:
+        for shape in shapes[tag]:
+            segments.extend(parse_path(element_to_path_string(shape)))
+    return SVGPT.Path(*segments).d()
+
+
+def tree_to_paths(tree):
+    """turns an svg tree into paths list"""
+    return element_to_paths(tree.getroot())
+
+
+def paths_to_loops(paths, tolerance=FLATTEN_TOLERANCE):
+    """"Convert a list of paths to a list of Loops"""
     point_loop_list = []
     for path_string in paths:
-        points = path_string_to_points(path_string)
-        if points is not None:
-            point_loop_list.append(points)
+        loop = path_string_to_loop(path_string, tolerance)
+        if loop is not None:
+            point_loop_list.append(loop)
     return point_loop_list
 
 
 def combine_paths(paths, as_list=True):
     """combines path strings into a single string"""
-    combined = ""
-    first = True
-    for path in paths:
-        if not first:
-            combined += " "
-        combined += path
-        first = False
+    combined = " ".join(paths)
 
     if as_list:
         return [combined]
@@ -55,36 +174,32 @@ def combine_paths(paths, as_list=True):
         return combined
 
 
-def path_string_to_points(path_string):
+def path_string_to_points(path_string, tolerance=FLATTEN_TOLERANCE):
     """Convert path string into a list of points"""
-    path = SVGPT.parse_path(path_string)
-
-    empty = SVGPT.Path()
-    if path == empty:
+    loop = _path_points(path_string, tolerance)
+    if loop is None:
         return None
-    points = []
-    for segment in path:
-        segment_points = subpath_to_points(segment)
-        for point in segment_points:
-            if points == [] or point != points[-1]:
-                points.append(point)
-    return points
+    return loop.points.tolist()
+
 
+def path_string_to_loop(path_string, tolerance=FLATTEN_TOLERANCE):
+    """Convert path string into a Loop (shared with the cache, so read only)"""
+    return _path_points(path_string, tolerance)
 
-def subpath_to_points(segment):
+
+def subpath_to_points(segment, tolerance=FLATTEN_TOLERANCE):
     """Converts a path segment into a list of points"""
     points = []
     if isinstance(segment, SVGPT.path.Line):  # pylint: disable=maybe-no-member
         points = points_from_line(segment)
     else:
-        points = points_from_curve(segment)
+        points = points_from_curve(segment, tolerance=tolerance)
     return points
 
 
 def get_start(path_string):
     """returns start point (x, y) of a path string"""
-    path = SVGPT.parse_path(path_string)
-    start_xy = complex_to_xy(path.start)
+    start_xy = list(_path_start(path_string))
     return start_xy
 
 
@@ -98,14 +213,52 @@ def points_from_line(line):
     return points_list
 
 
-def points_from_curve(curve, samples=20):
-    """returns poins along a curve"""
-    points_list = []
-    for location in range(samples):
-        fraction = location / (samples-1)
-        point_on_curve = curve.point(fraction)
-        points_list.append(complex_to_xy(point_on_curve))
-    return points_list
+def bezier_segment_count(curve, tolerance):
+    """number of lines needed to keep within tolerance of a bezier curve,
+    from the chord error bound max|B''| / (8 n^2)"""
+    control_points = np.array(curve.bpoints())
+    degree = len(control_points) - 1
+    if degree < 2:
+        return 1
+    second_differences = control_points[:-2] - 2 * control_points[1:-1] + control_points[2:]
+    max_second_derivative = degree * (degree - 1) * np.abs(second_differences).max()
+    return int(np.ceil(np.sqrt(max_second_derivative / (8.0 * tolerance))))
+
+
+def arc_segment_count(arc, tolerance):
+    """number of lines needed to keep within tolerance of an elliptical arc,
+    from the sagitta of the largest radius"""
+    radius = max(abs(arc.radius.real), abs(arc.radius.imag))
+    sweep = np.radians(abs(arc.delta))
+    if radius <= tolerance:
+        return int(np.ceil(sweep / np.pi))
+    step = 2.0 * np.arccos(1.0 - tolerance / radius)
+    return int(np.ceil(sweep / step))
+
+
+def curve_segment_count(curve, tolerance, samples=20):
+    """number of lines to flatten a curve into, falls back to samples-1
+    for curve types without an error bound"""
+    if isinstance(curve, SVGPT.path.Arc):  # pylint: disable=maybe-no-member
+        segments = arc_segment_count(curve, tolerance)
+    elif hasattr(curve, 'bpoints'):
+        segments = bezier_segment_count(curve, tolerance)
+    else:
+        segments = samples - 1
+    return min(max(segments, 1), MAX_CURVE_SEGMENTS)
+
+
+def points_from_curve(curve, samples=None, tolerance=FLATTEN_TOLERANCE):
+    """returns poins along a curve, either a fixed number of samples
+    or as few as keep within tolerance (mm) of the curve"""
+    if samples is None:
+        samples = curve_segment_count(curve, tolerance) + 1
+    fractions = np.linspace(0.0, 1.0, samples)
+    points_on_curve = np.asarray(curve.point(fractions), dtype=complex)
+    # pin the ends so neighbouring segments still meet exactly
+    points_on_curve[0] = curve.start
+    points_on_curve[-1] = curve.end
+    return np.column_stack((points_on_curve.real, points_on_curve.imag)).tolist()
 
 
 def complex_to_xy(complex_point):
@@ -120,6 +273,7 @@ def xy_to_complex(xy_point):
     return complex_point
 
 
+@timed('path.serialize')
 def loops_to_paths(loops):
     """turns a list of point loops into a list of path strings"""
     paths = []
@@ -129,6 +283,14 @@ def loops_to_paths(loops):
     return paths
 
 
+def count_path_vertices(paths):
+    """returns the number of points in a list of straight line path strings"""
+    vertices = 0
+    for path in paths:
+        vertices += path.count(" L ") + 1
+    return vertices
+
+
 def points_to_path(points, closed=True):
     """turn a series of points into a path"""
     first = True
@@ -145,7 +307,7 @@ def points_to_path(points, closed=True):
 
 def scale_path(path_string, scale):
     """scales a path string by a scale factor (float)"""
-    path = SVGPT.parse_path(path_string)
+    path = parse_path(path_string)
     scaled_path = path.scaled(scale)
     new_path_string = scaled_path.d()
     return new_path_string
@@ -154,7 +316,7 @@ def scale_path(path_string, scale):
 def move_path(path_string, xy_translation):
     """Takes a path string and xy_translation (x, y), and moves it x units over, and y units down"""
 
-    path = SVGPT.parse_path(path_string)
+    path = parse_path(path_string)
 
     empty = SVGPT.Path()
     if path == empty:
@@ -168,15 +330,13 @@ def move_path(path_string, xy_translation):
 
 def get_angle(path_string):
     """measures the angle in degrees (CCW) from the path positive X axis (0,0), (0,1)"""
-    path = SVGPT.parse_path(path_string)
-    vector = path.point(1) - path.point(0)
-    angle = np.angle(vector, deg=True)
+    angle = _path_angle(path_string)
     return angle
 
 
 def rotate_path(path_string, angle_degrees, xy_point):
     """rotates a path string a given number of degrees (CCW) around point (x, y)"""
-    path = SVGPT.parse_path(path_string)
+    path = parse_path(path_string)
 
     empty = SVGPT.Path()
     if path == empty:
@@ -188,10 +348,51 @@ def rotate_path(path_string, angle_degrees, xy_point):
     return rotated_string
 
 
+def translation_matrix(xy_translation):
+    """returns a 3x3 affine matrix that moves points x units over, and y units down"""
+    matrix = np.identity(3)
+    matrix[0:2, 2] = xy_translation
+    return matrix
+
+
+def rotation_matrix(angle_degrees, xy_point=(0, 0)):
+    """returns a 3x3 affine matrix that rotates points (CCW) around point (x, y)"""
+    radians = np.radians(angle_degrees)
+    cosine = np.cos(radians)
+    sine = np.sin(radians)
+    rotation = np.array([[cosine, -sine, 0.0],
+                         [sine, cosine, 0.0],
+                         [0.0, 0.0, 1.0]])
+    to_origin = translation_matrix((-xy_point[0], -xy_point[1]))
+    return translation_matrix(xy_point) @ rotation @ to_origin
+
+
+def placement_matrix(old_edge_path, xy_offset=(0, 0)):
+    """returns the affine matrix that lines up points drawn along the positive
+    X axis (moved by xy_offset) with old_edge_path, like place_new_edge_path"""
+    start_point = get_start(old_edge_path)
+    rotation_angle = get_angle(old_edge_path)
+    moved = translation_matrix(start_point) @ translation_matrix(xy_offset)
+    return rotation_matrix(rotation_angle, start_point) @ moved
+
+
+@timed('path.transform')
+def transform_loops(loops, matrices):
+    """applies one 3x3 affine matrix per loop in a single batched multiply"""
+    if not loops:
+        return []
+    sizes = [len(loop) for loop in loops]
+    points = np.concatenate([as_loop(loop).points for loop in loops])
+    homogeneous = np.hstack([points, np.ones((len(points), 1))])
+    point_matrices = np.repeat(np.asarray(matrices), sizes, axis=0)
+    transformed = np.einsum('nij,nj->ni', point_matrices, homogeneous)[:, 0:2]
+    split_points = np.split(transformed, np.cumsum(sizes)[:-1])
+    return [Loop(points) for points in split_points]
+
+
 def get_length(path_string):
     """returns the length of a path string"""
-    path = SVGPT.parse_path(path_string)
-    return path.length()
+    return _path_length(path_string)
 
 
 def get_all_segments(loops):
@@ -249,59 +450,110 @@ def segments_to_paths(segments):
 
 def get_not_overlapping(first, second):
     """returns the segments of the first path that do not overlap with the second."""
-    output_paths = []
-
-    first_loops = paths_to_loops(first)
-    second_loops = paths_to_loops(second)
-
-    for loop in first_loops:
-        not_overlapping = ""
-        segment_started = False
-        last_point = loop[-1]
-        for point in loop:
-            if not point_on_loops(point, second_loops):
-                if not segment_started:
-                    not_overlapping += f" M {last_point[0]},{last_point[1]}"
-                    segment_started = True
-                if last_point != point:
-                    not_overlapping += f" L {point[0]},{point[1]}"
-            else:  # close the path
-                if segment_started:
-                    not_overlapping += f" L {point[0]},{point[1]}"
-                    output_paths.append(not_overlapping)
-                    segment_started = False
-                    not_overlapping = ""
-            last_point = point
-        if segment_started:
-            output_paths.append(not_overlapping)
-    return output_paths
+    _, not_overlapping = split_overlapping(first, second)
+    return not_overlapping
 
 
 def get_overlapping(first, second):
     """returns the overlapping segments of the first and second path."""
-    output_paths = []
+    overlapping, _ = split_overlapping(first, second)
+    return overlapping
+
+
+def split_overlapping(first, second):
+    """returns (overlapping, not overlapping) segments of the first paths,
+    classifying every point against the second paths' edges just once"""
     first_loops = paths_to_loops(first)
-    second_loops = paths_to_loops(second)
+    segment_index = get_segment_index(paths_to_loops(second))
 
+    overlapping_paths = []
+    not_overlapping_paths = []
     for loop in first_loops:
-        overlapping = ""
-        segment_started = False
-        for point in loop:
-            if point_on_loops(point, second_loops):
-                if not segment_started:
-                    overlapping += f" M {point[0]},{point[1]}"
-                    segment_started = True
-                else:
-                    overlapping += f" L {point[0]},{point[1]}"
-            else:  # skip other points
-                if segment_started:
-                    output_paths.append(overlapping)
-                    overlapping = ""
-                segment_started = False
-        if segment_started:
-            output_paths.append(overlapping)
-
-    return output_paths
+        on_flags = points_on_segments(loop.points, segment_index)
+        overlapping, not_overlapping = split_loop(loop.points.tolist(), on_flags)
+        overlapping_paths += overlapping
+        not_overlapping_paths += not_overlapping
+    return overlapping_paths, not_overlapping_paths
+
+
+def split_loop(points, on_flags):
+    """splits a loop into paths of the points on (overlapping) and off
+    (not overlapping, joined up to the neighbouring points) in one pass"""
+    overlapping_paths = []
+    not_overlapping_paths = []
+    overlapping = []
+    not_overlapping = []
+    last_point = points[-1]
+    for point, on_loop in zip(points, on_flags):
+        if on_loop:
+            overlapping.append(f"{point[0]},{point[1]}")
+            if not_overlapping:
+                not_overlapping.append(f"{point[0]},{point[1]}")
+                not_overlapping_paths.append(" M " + " L ".join(not_overlapping))
+                not_overlapping = []
+        else:
+            if overlapping:
+                overlapping_paths.append(" M " + " L ".join(overlapping))
+                overlapping = []
+            if not not_overlapping:
+                not_overlapping.append(f"{last_point[0]},{last_point[1]}")
+            if last_point != point:
+                not_overlapping.append(f"{point[0]},{point[1]}")
+        last_point = point
+    if overlapping:
+        overlapping_paths.append(" M " + " L ".join(overlapping))
+    if not_overlapping:
+        not_overlapping_paths.append(" M " + " L ".join(not_overlapping))
+    return overlapping_paths, not_overlapping_paths
+
+
+def get_segment_index(loops):
+    """grid index of every edge of a list of closed loops in clipper units
+    (1/SCALING_FACTOR), the edge start and end points are kept as integer
+    arrays in 'starts' and 'ends'"""
+    # clipper sees no edges in loops of fewer than 3 points
+    scaled_loops = [np.asarray(loop_to_clipper(as_loop(loop)), dtype=np.int64)
+                    for loop in loops if len(loop) >= 3]
+    if scaled_loops == []:
+        starts = np.zeros((0, 2), dtype=np.int64)
+        ends = np.zeros((0, 2), dtype=np.int64)
+    else:
+        starts = np.concatenate(scaled_loops)
+        ends = np.concatenate([np.roll(loop, -1, axis=0) for loop in scaled_loops])
+    lower = np.minimum(starts, ends)
+    upper = np.maximum(starts, ends)
+    boxes = [tuple(box) for box in np.hstack((lower, upper)).tolist()]
+    # edges vary too much in size (long sides, tiny arc steps) for the median
+    # box, so aim for about one edge per cell across the whole extent
+    cell_size = 1.0
+    if boxes != []:
+        extent = float(np.max(upper.max(axis=0) - lower.min(axis=0)))
+        cell_size = max(extent / np.sqrt(len(boxes)), 1.0)
+    segment_index = get_box_index(boxes, cell_size)
+    segment_index['starts'] = starts
+    segment_index['ends'] = ends
+    return segment_index
+
+
+def points_on_segments(points, segment_index):
+    """returns for each point whether it is on an indexed edge, points are
+    truncated to clipper units and must be exactly on the edge, which is
+    what pyclipper.PointInPolygon reports as on (-1)"""
+    scaled_points = (np.asarray(points, dtype=float).reshape(-1, 2) *
+                     SCALING_FACTOR).astype(np.int64)
+    on_flags = []
+    for x_pos, y_pos in scaled_points.tolist():
+        candidates = query_box_index(segment_index, (x_pos, y_pos, x_pos, y_pos))
+        if candidates == []:
+            on_flags.append(False)
+            continue
+        starts = segment_index['starts'][candidates]
+        ends = segment_index['ends'][candidates]
+        # inside the box already, so on the edge when exactly in line with it
+        cross = ((ends[:, 0] - starts[:, 0]) * (y_pos - starts[:, 1]) -
+                 (ends[:, 1] - starts[:, 1]) * (x_pos - starts[:, 0]))
+        on_flags.append(bool((cross == 0).any()))
+    return on_flags
 
 
 def divide_pathstring_parts(pathstring):
@@ -319,54 +571,174 @@ def divide_pathstring_parts(pathstring):
     return paths
 
 
-# TODO: split open/closed separation into smaller chunks
+# distance under which two path ends are treated as the same point
+SNAP_TOLERANCE = 1e-6
+
+
+def get_endpoint_key(point, tolerance):
+    """quantizes a complex point into a grid cell key of size tolerance"""
+    if tolerance <= 0:
+        return (point.real, point.imag)
+    return (int(np.floor(point.real / tolerance)),
+            int(np.floor(point.imag / tolerance)))
+
+
+def get_neighbor_keys(key, tolerance):
+    """returns the cell key and the cells around it"""
+    if tolerance <= 0:
+        return [key]
+    return [(key[0] + column, key[1] + row)
+            for column in (-1, 0, 1) for row in (-1, 0, 1)]
+
 
+def add_endpoints(endpoint_index, chain_id, segments, tolerance):
+    """adds both ends of a chain of segments to the endpoint index"""
+    for end, point in (('start', segments[0].start), ('end', segments[-1].end)):
+        key = get_endpoint_key(point, tolerance)
+        endpoint_index.setdefault(key, []).append((chain_id, end))
 
-def separate_closed_paths(paths):
+
+def remove_endpoints(endpoint_index, chain_id, segments, tolerance):
+    """removes both ends of a chain of segments from the endpoint index"""
+    for end, point in (('start', segments[0].start), ('end', segments[-1].end)):
+        key = get_endpoint_key(point, tolerance)
+        endpoint_index[key].remove((chain_id, end))
+        if not endpoint_index[key]:
+            del endpoint_index[key]
+
+
+def find_endpoint(endpoint_index, chains, point, end, tolerance):
+    """returns id of a chain whose start or end (end) is within tolerance of point"""
+    key = get_endpoint_key(point, tolerance)
+    for neighbor_key in get_neighbor_keys(key, tolerance):
+        for chain_id, chain_end in endpoint_index.get(neighbor_key, []):
+            if chain_end != end:
+                continue
+            segments = chains[chain_id]
+            chain_point = segments[0].start if end == 'start' else segments[-1].end
+            if abs(chain_point - point) <= tolerance:
+                return chain_id
+    return None
+
+
+def snap_segment(segment, start=None, end=None):
+    """returns a copy of a segment with its start and/or end moved to close a gap"""
+    start = segment.start if start is None else start
+    end = segment.end if end is None else end
+    if isinstance(segment, SVGPT.path.Line):  # pylint: disable=maybe-no-member
+        return SVGPT.path.Line(start, end)  # pylint: disable=maybe-no-member
+    if isinstance(segment, SVGPT.path.QuadraticBezier):  # pylint: disable=maybe-no-member
+        return SVGPT.path.QuadraticBezier(  # pylint: disable=maybe-no-member
+            start, segment.control, end)
+    if isinstance(segment, SVGPT.path.CubicBezier):  # pylint: disable=maybe-no-member
+        return SVGPT.path.CubicBezier(  # pylint: disable=maybe-no-member
+            start, segment.control1, segment.control2, end)
+    return SVGPT.path.Arc(start, segment.radius,  # pylint: disable=maybe-no-member
+                          segment.rotation, segment.large_arc,
+                          segment.sweep, end)
+
+
+def reverse_segments(segments):
+    """reverses the direction of a chain of segments"""
+    return [segment.reversed() for segment in reversed(segments)]
+
+
+def join_segments(first, second):
+    """appends chain second to the end of chain first, closing any small gap"""
+    if second[0].start != first[-1].end:
+        second = [snap_segment(second[0], start=first[-1].end)] + second[1:]
+    return first + second
+
+
+def close_segments(segments, tolerance):
+    """returns closed chain if its ends meet within tolerance, otherwise None"""
+    if abs(segments[-1].end - segments[0].start) > tolerance:
+        return None
+    if segments[-1].end != segments[0].start:
+        segments = segments[:-1] + \
+            [snap_segment(segments[-1], end=segments[0].start)]
+    return segments
+
+
+def connect_chain(segments, endpoint_index, chains, tolerance):
+    """finds an open chain touching either end of segments,
+    returns its id and the joined chain (or None, None)"""
+    start = segments[0].start
+    end = segments[-1].end
+
+    other_id = find_endpoint(endpoint_index, chains, end, 'start', tolerance)
+    if other_id is not None:
+        return other_id, join_segments(segments, chains[other_id])
+    other_id = find_endpoint(endpoint_index, chains, start, 'end', tolerance)
+    if other_id is not None:
+        return other_id, join_segments(chains[other_id], segments)
+    other_id = find_endpoint(endpoint_index, chains, end, 'end', tolerance)
+    if other_id is not None:
+        return other_id, join_segments(segments,
+                                       reverse_segments(chains[other_id]))
+    other_id = find_endpoint(endpoint_index, chains, start, 'start', tolerance)
+    if other_id is not None:
+        return other_id, join_segments(reverse_segments(segments),
+                                       chains[other_id])
+    return None, None
+
+
+@timed('path.stitch')
+def separate_closed_paths(paths, tolerance=SNAP_TOLERANCE):
     """takes a list of path strings
     breaks non continuous paths and
-    joins connecting paths together
+    joins connecting paths (ends within tolerance) together
     to return a list of closed paths """
     discrete_paths = []
     closed_paths = []
-    open_paths = []
     dead_ends = []
     for path in paths:
         discrete_paths += divide_pathstring_parts(path)
+
+    # open paths are kept as lists of segments, indexed by their end points
+    chains = {}
+    endpoint_index = {}
     for path in discrete_paths:
-        parsed_path = SVGPT.parse_path(path)
+        parsed_path = parse_path(path)
         if parsed_path.isclosed():
             closed_paths.append(path)
+        elif len(parsed_path) > 0:
+            chain_id = len(chains)
+            chains[chain_id] = list(parsed_path)
+            add_endpoints(endpoint_index, chain_id,
+                          chains[chain_id], tolerance)
+
+    next_id = len(chains)
+    open_ids = list(chains)
+    while open_ids:
+        chain_id = open_ids.pop()
+        if chain_id not in chains:  # already joined onto another chain
+            continue
+        segments = chains.pop(chain_id)
+        remove_endpoints(endpoint_index, chain_id, segments, tolerance)
+
+        closed_segments = close_segments(segments, tolerance)
+        if closed_segments is not None:
+            closed_paths.append(SVGPT.Path(*closed_segments).d())
+            continue
+
+        other_id, new_segments = connect_chain(
+            segments, endpoint_index, chains, tolerance)
+        if other_id is None:
+            dead_ends.append(SVGPT.Path(*segments).d())
+            continue
+
+        other_segments = chains.pop(other_id)
+        remove_endpoints(endpoint_index, other_id, other_segments, tolerance)
+
+        closed_segments = close_segments(new_segments, tolerance)
+        if closed_segments is not None:
+            closed_paths.append(SVGPT.Path(*closed_segments).d())
         else:
-            open_paths.append(parsed_path)
-    while open_paths:
-        path = open_paths.pop()
-        new_path = None
-        for other_path in open_paths:
-            if path.end == other_path.start:
-                new_path = path.d() + " " + other_path.d().replace('M', 'L')
-                open_paths.remove(other_path)
-                break
-            elif path.start == other_path.end:
-                new_path = other_path.d() + " " + path.d().replace('M', 'L')
-                open_paths.remove(other_path)
-                break
-            elif path.end == other_path.end:
-                new_path = path.d() + " " + other_path.reversed().d().replace('M', 'L')
-                open_paths.remove(other_path)
-                break
-            elif path.start == other_path.start:
-                new_path = path.reversed().d() + " " + other_path.d().replace('M', 'L')
-                open_paths.remove(other_path)
-                break
-        if new_path is not None:
-            parsed_new_path = SVGPT.parse_path(new_path)
-            if parsed_new_path.isclosed():
-                closed_paths.append(new_path)
-            else:
-                open_paths.append(parsed_new_path)
-        else:
-            dead_ends.append(path.d())
+            chains[next_id] = new_segments
+            add_endpoints(endpoint_index, next_id, new_segments, tolerance)
+            open_ids.append(next_id)
+            next_id += 1
 
     open_paths = dead_ends
     return closed_paths, open_paths
@@ -376,16 +748,64 @@ def is_inside(path, other_path):
     """checks if path is inside other_path and returns true or false"""
     loop = paths_to_loops([path])[0]
     other_loop = paths_to_loops([other_path])[0]
-    for point in loop:
-        if point_inside_loop(point, other_loop) == 1:
-            return True
-    return False
+    return loop_inside_loop(loop, other_loop)
+
+
+def get_bounding_box(loop):
+    """returns the bounding box (min x, min y, max x, max y) of a loop"""
+    return as_loop(loop).bbox
+
+
+def boxes_overlap(first, second):
+    """True if two bounding boxes touch or overlap"""
+    return (first[0] <= second[2] and second[0] <= first[2] and
+            first[1] <= second[3] and second[1] <= first[3])
+
+
+def get_box_cells(box, cell_size):
+    """returns the grid cells (column, row) covered by a bounding box"""
+    first_column = int(np.floor(box[0] / cell_size))
+    last_column = int(np.floor(box[2] / cell_size))
+    first_row = int(np.floor(box[1] / cell_size))
+    last_row = int(np.floor(box[3] / cell_size))
+    cells = []
+    for column in range(first_column, last_column + 1):
+        for row in range(first_row, last_row + 1):
+            cells.append((column, row))
+    return cells
+
+
+def get_box_index(boxes, cell_size=None):
+    """bins bounding boxes into a uniform grid so overlapping boxes can be
+    found without comparing every pair, cell size defaults to the median box"""
+    if cell_size is None:
+        sizes = [max(box[2] - box[0], box[3] - box[1]) for box in boxes]
+        cell_size = float(np.median(sizes)) if sizes else 1.0
+        if cell_size <= 0:
+            cell_size = 1.0
+    cells = {}
+    for index, box in enumerate(boxes):
+        for cell in get_box_cells(box, cell_size):
+            cells.setdefault(cell, []).append(index)
+    return {'boxes': boxes, 'cells': cells, 'cell_size': cell_size}
+
+
+def query_box_index(box_index, box):
+    """returns sorted indices of the boxes in box_index that overlap box"""
+    candidates = set()
+    for cell in get_box_cells(box, box_index['cell_size']):
+        candidates.update(box_index['cells'].get(cell, []))
+    overlapping = []
+    for index in sorted(candidates):
+        if boxes_overlap(box_index['boxes'][index], box):
+            overlapping.append(index)
+    return overlapping
 
 
 def path_to_segments(path_string):
     """breaks down a path into a list of segments"""
     segments = []
-    path = SVGPT.parse_path(path_string)
+    path = parse_path(path_string)
     for segment in path:
         if isinstance(segment, SVGPT.path.Line):  # pylint: disable=maybe-no-member
             points = points_from_line(segment)
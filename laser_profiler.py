@@ -0,0 +1,90 @@
+# laser_profiler.py
+"""Keeps a cProfile of any request that runs slowly, along with its input
+
+Turned on by setting LASER_PROFILE_DIR. Requests taking longer than
+LASER_SLOW_SECONDS leave a <capture>.prof (open with pstats or snakeviz)
+and a <capture>.json holding the request input, and only the newest
+LASER_PROFILES_KEPT captures are kept.
+"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+
+PROFILE_DIR = os.environ.get('LASER_PROFILE_DIR')
+SLOW_REQUEST_SECONDS = float(os.environ.get('LASER_SLOW_SECONDS', 5.0))
+PROFILES_KEPT = int(os.environ.get('LASER_PROFILES_KEPT', 20))
+
+
+class SlowRequestProfiler:
+    """profiles calls and saves the ones slower than a threshold"""
+
+    def __init__(self, directory=PROFILE_DIR, threshold=SLOW_REQUEST_SECONDS,
+                 keep=PROFILES_KEPT):
+        self.directory = directory
+        self.threshold = threshold
+        self.keep = keep
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        """True when there is somewhere to save profiles"""
+        return self.directory is not None
+
+    def run(self, name, inputs, function, *args):
+        """returns function(*args), saving a profile and inputs (a json-able dict,
+        or a function returning one, only called for a slow request)
+        if it took longer than the threshold"""
+        if not self.enabled:
+            return function(*args)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is already active, run without one
+            return function(*args)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            if seconds >= self.threshold:
+                self.save(name, inputs, profiler, seconds)
+
+    def save(self, name, inputs, profiler, seconds):
+        """writes the profile and request input, then drops old captures"""
+        capture = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}"
+        base = os.path.join(self.directory, capture)
+        profiler.dump_stats(base + ".prof")
+        if callable(inputs):
+            inputs = inputs()
+        with open(base + ".json", "w") as input_file:
+            json.dump({'name': name,
+                       'seconds': seconds,
+                       'time': time.time(),
+                       'inputs': inputs}, input_file)
+        self.prune()
+
+    def captures(self):
+        """returns capture names, oldest first"""
+        profiles = [entry for entry in os.scandir(self.directory)
+                    if entry.name.endswith(".prof")]
+        profiles.sort(key=lambda entry: entry.stat().st_mtime)
+        return [entry.name[:-len(".prof")] for entry in profiles]
+
+    def prune(self):
+        """removes the oldest captures beyond the retention cap"""
+        with self._lock:
+            captures = self.captures()
+            for capture in captures[:max(0, len(captures) - self.keep)]:
+                for extension in (".prof", ".json"):
+                    try:
+                        os.remove(os.path.join(self.directory, capture + extension))
+                    except OSError:
+                        pass
@@ -0,0 +1,197 @@
+# laser_sessions.py
+"""Designs kept on the server between edits, changed by json-patch deltas
+
+A session holds {'model': ..., 'params': ...}. The model is uploaded once,
+then each edit sends only the operations that change it, eg.
+[{"op": "replace", "path": "/params/kerf", "value": 0.2}]
+(add, remove, replace and test from RFC 6902, paths are RFC 6901 pointers).
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# sessions kept, the least recently used is dropped first
+SESSION_LIMIT = int(os.environ.get('LASER_SESSIONS', 256))
+# seconds a session is kept after it was last used
+SESSION_TTL = float(os.environ.get('LASER_SESSION_TTL', 3600))
+
+
+def split_pointer(pointer):
+    """returns the reference tokens of a json pointer, eg. '/joints/J1' -> ['joints', 'J1']"""
+    if not isinstance(pointer, str) or (pointer != "" and not pointer.startswith("/")):
+        raise ValueError(f"bad json pointer {pointer!r}")
+    if pointer == "":
+        return []
+    return [token.replace("~1", "/").replace("~0", "~")
+            for token in pointer[1:].split("/")]
+
+
+def list_index(items, token, allow_end=False):
+    """returns the list index a pointer token refers to"""
+    if allow_end and token == "-":
+        return len(items)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise ValueError(f"bad list index {token!r}")
+    index = int(token)
+    if index > len(items) or (index == len(items) and not allow_end):
+        raise ValueError(f"list index {index} out of range")
+    return index
+
+
+def resolve_pointer(document, tokens):
+    """returns the value a list of pointer tokens refers to"""
+    value = document
+    for token in tokens:
+        if isinstance(value, dict):
+            if token not in value:
+                raise ValueError(f"no member {token!r}")
+            value = value[token]
+        elif isinstance(value, list):
+            value = value[list_index(value, token)]
+        else:
+            raise ValueError(f"can't look up {token!r} in a {type(value).__name__}")
+    return value
+
+
+def patch_container(container, tokens, operation):
+    """returns a copy of container with the operation applied at tokens,
+    only the containers along the path are copied"""
+    if isinstance(container, dict):
+        patched = dict(container)
+    elif isinstance(container, list):
+        patched = list(container)
+    else:
+        raise ValueError(f"can't patch inside a {type(container).__name__}")
+    token = tokens[0]
+
+    if len(tokens) > 1:
+        if isinstance(patched, dict):
+            if token not in patched:
+                raise ValueError(f"no member {token!r}")
+            key = token
+        else:
+            key = list_index(patched, token)
+        patched[key] = patch_container(patched[key], tokens[1:], operation)
+        return patched
+
+    op = operation['op']
+    if isinstance(patched, dict):
+        if op != 'add' and token not in patched:
+            raise ValueError(f"no member {token!r}")
+        if op == 'remove':
+            del patched[token]
+        else:
+            patched[token] = operation['value']
+    else:
+        index = list_index(patched, token, allow_end=(op == 'add'))
+        if op == 'add':
+            patched.insert(index, operation['value'])
+        elif op == 'remove':
+            del patched[index]
+        else:
+            patched[index] = operation['value']
+    return patched
+
+
+def apply_patch(document, operations):
+    """returns document with the json-patch operations applied, the document
+    passed in is left unchanged (so it can still be rendered meanwhile)"""
+    if not isinstance(operations, list):
+        raise ValueError("a patch is a list of operations")
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError("a patch operation is an object")
+        op = operation.get('op')
+        if op not in ('add', 'remove', 'replace', 'test'):
+            raise ValueError(f"unsupported patch operation {op!r}")
+        if op != 'remove' and 'value' not in operation:
+            raise ValueError(f"'{op}' needs a value")
+        tokens = split_pointer(operation.get('path'))
+        if op == 'test':
+            if resolve_pointer(document, tokens) != operation['value']:
+                raise ValueError(f"test failed at {operation['path']!r}")
+        elif not tokens:
+            if op == 'remove':
+                raise ValueError("can't remove the whole document")
+            document = operation['value']
+        else:
+            document = patch_container(document, tokens, operation)
+    return document
+
+
+class SessionStore:
+    """sessions by id, evicted when least recently used or idle too long"""
+
+    def __init__(self, limit=SESSION_LIMIT, ttl=SESSION_TTL):
+        self.limit = limit
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, model, params=None):
+        """stores a new session, returns its id"""
+        session_id = uuid.uuid4().hex
+        session = {'document': {'model': model, 'params': params},
+                   'version': 0,
+                   'used': time.monotonic()}
+        with self._lock:
+            self._sessions[session_id] = session
+            self._evict()
+        return session_id
+
+    def get(self, session_id):
+        """returns (document, version) of a session, or None if unknown or expired"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None
+            return session['document'], session['version']
+
+    def update(self, session_id, operations):
+        """applies json-patch operations to a session, returns the new version,
+        raises KeyError for an unknown session and ValueError for a bad patch"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                raise KeyError(session_id)
+            try:
+                document = apply_patch(session['document'], operations)
+            except (KeyError, IndexError, TypeError) as error:
+                # KeyError is kept for unknown sessions
+                raise ValueError(f"{type(error).__name__}: {error}") from error
+            if not isinstance(document, dict) or 'model' not in document:
+                raise ValueError("a session document needs a model")
+            session['document'] = document
+            session['version'] += 1
+            return session['version']
+
+    def delete(self, session_id):
+        """forgets a session, returns whether it existed"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._evict()
+            return len(self._sessions)
+
+    def _touch(self, session_id):
+        """returns a live session marked as just used (lock held)"""
+        self._evict()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session['used'] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _evict(self):
+        """drops expired sessions and the oldest beyond the limit (lock held)"""
+        oldest_allowed = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.limit and session['used'] >= oldest_allowed:
+                break
+            del self._sessions[session_id]
@@ -3,11 +3,33 @@
    python dictionary models for laser cutting applications"""
 
 import xml.etree.ElementTree as ET
+import base64
+import binascii
 import json
+import os
+import zlib
 
-from laser_svg_utils import (element_to_tree, get_attributes, new_svg_tree,
-                             path_string_to_element, tree_to_file)
-from laser_path_utils import tree_to_paths, combine_paths, is_inside
+from laser_svg_utils import (new_svg_tree,
+                             path_string_to_element, SVG_NAMESPACE,
+                             escape_attribute, qualify_attributes,
+                             start_tag, chunks_to_file)
+from laser_path_utils import (element_to_paths, combine_paths,
+                              path_string_to_loop, get_bounding_box,
+                              get_box_index, query_box_index)
+from laser_clipper import loop_inside_loop
+from laser_metrics import timed
+
+METADATA_TAG = f'{{{SVG_NAMESPACE}}}metadata'
+LASER_METADATA_TAG = f'{{{SVG_NAMESPACE}}}laserassistant'
+
+# header of the compact embeded model: "<encoding>:<base64 of zlib'd json>",
+# bump the number if the payload layout ever changes
+COMPACT_MODEL_ENCODING = "lazb1"
+# LASER_COMPACT_METADATA=1 writes the compact form by default (plain json
+# otherwise), both forms are always read
+COMPACT_METADATA = os.environ.get('LASER_COMPACT_METADATA', '0') not in ('', '0')
+# largest embeded model (json bytes) a compact payload may inflate to
+MAX_MODEL_BYTES = 64 * 1024 * 1024
 
 
 def parse_svg_tree(svg_root, attrib):
@@ -23,10 +45,9 @@ def parse_svg_tree(svg_root, attrib):
             name = item.attrib['data-name']
             svg_data[name] = parse_svg_tree(item, attrib)
         else:
-            tree = element_to_tree(item, attrib)
             if 'paths' not in svg_data:
                 svg_data['paths'] = []
-            new_paths = tree_to_paths(tree)
+            new_paths = element_to_paths(item)
             for path in new_paths:
                 svg_data['paths'].append(path)
             if 'style' in item.attrib:
@@ -34,12 +55,56 @@ def parse_svg_tree(svg_root, attrib):
     return svg_data
 
 
+@timed('svg.parse')
+def read_svg(filename):
+    """parses an svg file (name or file object) once, returns the root element"""
+    return ET.parse(filename).getroot()
+
+
+def root_attributes(svg_root):
+    """returns a copy of the svg root attributes, with the svg namespace"""
+    attrib = dict(svg_root.attrib)
+    if "xmlns" not in attrib:
+        attrib["xmlns"] = SVG_NAMESPACE
+    return attrib
+
+
+@timed('svg.parse')
+def stream_svg(filename, keep_tree=True):
+    """streams an svg (name or file object) and stops as soon as embeded
+    laserassistant metadata is found, returning (model, None). Without it
+    returns (None, svg root), or (None, None) if not keep_tree, in which case
+    elements are cleared as they end so memory stays flat"""
+    svg_root = None
+    open_tags = []
+    for event, element in ET.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            open_tags.append(element.tag)
+            if svg_root is None:
+                svg_root = element
+            elif open_tags[1:] == [METADATA_TAG, LASER_METADATA_TAG]:
+                return decode_model(element.attrib['model']), None
+        else:
+            open_tags.pop()
+            if len(open_tags) == 1 and not keep_tree:
+                svg_root.clear()
+    if not keep_tree:
+        svg_root = None
+    return None, svg_root
+
+
+def extract_embeded_model(filename):
+    """extracts embeded model if there is one in metadata"""
+    model, _ = stream_svg(filename, keep_tree=False)
+    return model
+
+
 def parse_svgfile(filename):
     """Read joints and shapes from specially formatted SVG file."""
     svg_data = {}
-    tree = ET.parse(filename)
-    attrib = get_attributes(tree)
-    svg_data['tree'] = parse_svg_tree(tree.getroot(), attrib)
+    svg_root = read_svg(filename)
+    attrib = root_attributes(svg_root)
+    svg_data['tree'] = parse_svg_tree(svg_root, attrib)
     svg_data['attrib'] = attrib
     return svg_data
 
@@ -72,7 +137,42 @@ def tree_to_svg(tree_dict, svg_root):
             path_from_dict(tree_dict, svg_root)
 
 
-def model_to_svg_tree(model, design=None):
+def encode_model(model, compact=None):
+    """returns a model as text for the metadata attribute, plain json or
+    (if compact) compressed json behind a version header"""
+    if compact is None:
+        compact = COMPACT_METADATA
+    if not compact:
+        return json.dumps(model)
+    packed = zlib.compress(json.dumps(model, separators=(",", ":")).encode("utf-8"), 9)
+    return f"{COMPACT_MODEL_ENCODING}:{base64.b64encode(packed).decode('ascii')}"
+
+
+def decode_model(text):
+    """returns the model from metadata attribute text in either encoding"""
+    if text.lstrip().startswith("{"):
+        return json.loads(text)
+    encoding, _, payload = text.partition(":")
+    if encoding != COMPACT_MODEL_ENCODING:
+        raise ValueError(f"unknown embeded model encoding '{encoding}'")
+    try:
+        packed = base64.b64decode(payload, validate=True)
+    except binascii.Error as error:
+        raise ValueError(f"bad embeded model payload: {error}") from error
+    # inflate at most MAX_MODEL_BYTES, so a tiny upload can't expand to gigabytes
+    decompressor = zlib.decompressobj()
+    try:
+        model_json = decompressor.decompress(packed, MAX_MODEL_BYTES)
+    except zlib.error as error:
+        raise ValueError(f"bad embeded model payload: {error}") from error
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"embeded model is over {MAX_MODEL_BYTES} bytes")
+    if not decompressor.eof:
+        raise ValueError("embeded model payload is cut short")
+    return json.loads(model_json)
+
+
+def model_to_svg_tree(model, design=None, compact=None):
     """Convert dictionary model with tree + attrib into SVG XML"""
     assert isinstance(model, dict)
     assert 'tree' in model
@@ -88,18 +188,81 @@ def model_to_svg_tree(model, design=None):
 
     if design is None:
         design = model
-    embed_model(design, svg_tree)
+    embed_model(design, svg_tree, compact)
 
     tree_to_svg(dict_tree, svg_root)
 
     return svg_tree
 
 
-def embed_model(model, tree):
+def model_to_svg_chunks(model, design=None, compact=None):
+    """Convert dictionary model with tree + attrib into SVG text, yielded
+    a piece at a time so large outputs never sit in memory as one string"""
+    assert isinstance(model, dict)
+    assert 'tree' in model
+    assert isinstance(model['tree'], dict)
+    assert 'attrib' in model
+    assert isinstance(model['attrib'], dict)
+
+    attrib = dict(model['attrib'])
+    if "xmlns" not in attrib:
+        attrib["xmlns"] = SVG_NAMESPACE
+    yield start_tag('svg', qualify_attributes(attrib))
+
+    if design is None:
+        design = model
+    yield from metadata_to_chunks(design, compact=compact)
+
+    yield from tree_to_chunks(model['tree'])
+    yield "</svg>"
+
+
+def metadata_to_chunks(model, batch_size=1024, compact=None):
+    """embedded model metadata as svg text, plain json is encoded a batch
+    of tokens at a time (the compact form is small enough to do at once)"""
+    if compact is None:
+        compact = COMPACT_METADATA
+    yield '<metadata><laserassistant model="'
+    if compact:
+        yield encode_model(model, compact=True)
+        yield '" /></metadata>'
+        return
+    batch = []
+    for token in json.JSONEncoder().iterencode(model):
+        batch.append(token)
+        if len(batch) >= batch_size:
+            yield escape_attribute("".join(batch))
+            batch = []
+    yield escape_attribute("".join(batch))
+    yield '" /></metadata>'
+
+
+def tree_to_chunks(tree_dict):
+    """recursively turn dict into SVG layers + paths text"""
+    for key, value in tree_dict.items():
+        if isinstance(value, dict):
+            yield start_tag('g', {'id': key, 'data-name': key})
+            yield from tree_to_chunks(value)
+            yield "</g>"
+        elif key == 'paths':
+            yield from paths_to_chunks(value)
+
+
+def paths_to_chunks(paths):
+    """one combined path element, written out path by path"""
+    yield '<path d="'
+    separator = ""
+    for path in paths:
+        yield separator + escape_attribute(path)
+        separator = " "
+    yield '" />'
+
+
+def embed_model(model, tree, compact=None):
     """embeds a model in an svg tree as metadata"""
     root = tree.getroot()
     metadata = ET.Element("metadata")
-    ET.SubElement(metadata, "laserassistant", {"model": json.dumps(model)})
+    ET.SubElement(metadata, "laserassistant", {"model": encode_model(model, compact)})
     root.append(metadata)
 
 
@@ -112,23 +275,37 @@ def model_to_json(model, filename="", indent=None):
     return json_model
 
 
-def model_to_svg_file(model, design=None, filename="output.svg"):
+@timed('svg.write')
+def model_to_svg_file(model, design=None, filename="output.svg", compact=None):
     """Outputs model to SVG file"""
-    svg_tree = model_to_svg_tree(model, design=design)
-    tree_to_file(svg_tree, filename=filename)
+    chunks_to_file(model_to_svg_chunks(model, design=design, compact=compact),
+                   filename=filename)
+
+
+@timed('svg.write')
+def model_to_svg_string(model, design=None, compact=None):
+    """Outputs model as SVG text, in memory"""
+    return "".join(model_to_svg_chunks(model, design=design, compact=compact))
 
 
+@timed('svg.separate')
 def separate_perims_from_cuts(paths):
     """take a list of paths and returns two lists of paths faces and cuts."""
     perims = []
     cuts = []
 
-    for path in paths:
+    # sample each path once, then only test paths whose boxes overlap
+    loops = [path_string_to_loop(path) for path in paths]
+    box_index = get_box_index([get_bounding_box(loop) for loop in loops])
+
+    for index, path in enumerate(paths):
         inside = False
-        for other_path in paths:
-            if other_path is not path:
-                if is_inside(path, other_path):
+        box = box_index['boxes'][index]
+        for other_index in query_box_index(box_index, box):
+            if other_index != index:
+                if loop_inside_loop(loops[index], loops[other_index]):
                     inside = True
+                    break
         if inside:
             cuts.append(path)
         else:
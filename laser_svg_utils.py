@@ -2,7 +2,15 @@
 """Utility functions for working with SVGs for laser cutting"""
 
 import xml.etree.ElementTree as ET
-import tempfile
+from xml.sax.saxutils import escape
+
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+# size of the write buffer used when streaming svg text to a file
+SVG_BUFFER_SIZE = 1 << 16
+# characters that need replacing inside a double quoted attribute value
+ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#09;"}
+# namespaces that have a prefix without being declared
+RESERVED_PREFIXES = {"http://www.w3.org/XML/1998/namespace": "xml"}
 
 
 def get_attributes(tree):
@@ -40,15 +48,6 @@ def element_to_tree(element, attrib):
     return tree
 
 
-def tree_to_tempfile(tree):
-    """turn SVG tree into a tempfile"""
-    temp_svg = tempfile.NamedTemporaryFile(suffix=".svg", delete=False)
-    svg_bytes = svg_string(tree).encode('utf-8')
-    temp_svg.write(svg_bytes)
-    temp_svg.close()
-    return temp_svg
-
-
 def tree_to_file(tree, filename="output.svg"):
     """turn SVG tree into a tempfile"""
     svg_file = open(filename, "w")
@@ -57,6 +56,47 @@ def tree_to_file(tree, filename="output.svg"):
     svg_file.close()
 
 
+def escape_attribute(value):
+    """escapes text for use inside a double quoted attribute value"""
+    return escape(str(value), ATTRIBUTE_ENTITIES)
+
+
+def qualify_attributes(attrib):
+    """returns attributes with {namespace}name keys written as prefix:name,
+    declaring a prefix for each namespace that needs one"""
+    qualified = {}
+    prefixes = {}
+    for key, value in attrib.items():
+        if key.startswith("{"):
+            namespace, name = key[1:].split("}", 1)
+            prefix = RESERVED_PREFIXES.get(namespace)
+            if prefix is None:
+                if namespace not in prefixes:
+                    prefixes[namespace] = f"ns{len(prefixes)}"
+                prefix = prefixes[namespace]
+            key = f"{prefix}:{name}"
+        qualified[key] = value
+    for namespace, prefix in prefixes.items():
+        qualified[f"xmlns:{prefix}"] = namespace
+    return qualified
+
+
+def start_tag(tag, attrib, empty=False):
+    """returns the opening tag of an element (or the whole element if empty)"""
+    attributes = "".join(f' {key}="{escape_attribute(value)}"'
+                         for key, value in attrib.items())
+    if empty:
+        return f"<{tag}{attributes} />"
+    return f"<{tag}{attributes}>"
+
+
+def chunks_to_file(chunks, filename="output.svg"):
+    """writes svg text to a file as it is generated, through a buffer"""
+    with open(filename, "w", buffering=SVG_BUFFER_SIZE) as svg_file:
+        for chunk in chunks:
+            svg_file.write(chunk)
+
+
 def path_string_to_element(path_string, style=""):
     """Create SVG Element from path string"""
     # if style == "":
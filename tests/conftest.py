@@ -0,0 +1,18 @@
+"""lets the tests import the laser_* modules from the repository root"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import laser_metrics  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    """starts every test with no metrics recorded by the ones before"""
+    laser_metrics.reset()
+    yield
+    laser_metrics.reset()
@@ -0,0 +1,76 @@
+"""tests of the face processing pipeline"""
+
+import pytest
+
+from laser_assistant import (get_face_pool, map_faces, discard_face_pool,
+                             get_processed_model, svg_string_to_model,
+                             get_visible_hidden, get_outside_kerf, get_inside_kerf)
+from laser_path_utils import MIN_FLATTEN_TOLERANCE
+
+
+def test_map_faces_recovers_from_broken_pool():
+    """a pool whose workers died is replaced and the faces still come back"""
+    jobs = list(range(-12, 0))
+    expected = [abs(job) for job in jobs]
+    pool = get_face_pool(2)
+    assert list(map_faces(abs, jobs, workers=2)) == expected
+
+    # pylint: disable=protected-access
+    for process in list(pool._processes.values()):
+        process.kill()
+        process.join()
+
+    assert list(map_faces(abs, jobs, workers=2)) == expected
+    new_pool = get_face_pool(2)
+    assert new_pool is not pool
+    assert list(map_faces(abs, jobs, workers=2)) == expected
+    discard_face_pool(2, new_pool)
+
+
+CIRCLE_SVG = ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">'
+              '<rect x="0" y="0" width="100" height="100" />'
+              '<circle cx="50" cy="50" r="20" /></svg>')
+LASER_PARAMETERS = {'thickness': 3.0, 'kerf': 0.1, 'material': 'Wood', 'scaleFactor': 1.0}
+
+
+@pytest.mark.parametrize('tolerance', [0, -0.01, "0.01", None])
+def test_bad_tolerance_is_a_value_error(tolerance):
+    """a tolerance that isn't a number above 0 is refused up front"""
+    model = svg_string_to_model(CIRCLE_SVG)
+    parameters = dict(LASER_PARAMETERS, tolerance=tolerance)
+    with pytest.raises(ValueError, match="tolerance"):
+        get_processed_model(model, parameters, workers=1)
+
+
+def test_tiny_tolerance_is_clamped():
+    """a tolerance far below MIN_FLATTEN_TOLERANCE flattens like the minimum"""
+    model = svg_string_to_model(CIRCLE_SVG)
+    tiny = get_processed_model(model, dict(LASER_PARAMETERS, tolerance=1e-12), workers=1)
+    minimum = get_processed_model(model, dict(LASER_PARAMETERS, tolerance=MIN_FLATTEN_TOLERANCE),
+                                  workers=1)
+    assert tiny['tree'] == minimum['tree']
+
+
+@pytest.mark.parametrize('kerf_join', ['bevel', {'Wood': 'Round'}, ['round']])
+def test_unknown_kerf_join_is_a_value_error(kerf_join):
+    """a join type clipper doesn't have is refused with the allowed names"""
+    model = svg_string_to_model(CIRCLE_SVG)
+    parameters = dict(LASER_PARAMETERS, kerf_join=kerf_join)
+    with pytest.raises(ValueError, match="round, miter, square"):
+        get_processed_model(model, parameters, workers=1)
+
+
+def kerf_tree():
+    """returns a face tree with an original square and a processed notched square"""
+    return {'Face1': {
+        'Original': {'paths': ["M 0,0 L 40,0 L 40,40 L 0,40 Z"]},
+        'Processed': {'paths': ["M 0,0 L 15,0 L 15,5 L 25,5 L 25,0 L 40,0 L 40,40 L 0,40 Z"]}}}
+
+
+def test_visible_hidden_matches_outside_and_inside_kerf():
+    """filling both layers at once gives the same layers as one at a time"""
+    parameters = {'slow_kerf': 0.2, 'fast_kerf': 0.1}
+    both = get_visible_hidden(kerf_tree(), parameters)['Face1']
+    assert both['Visible'] == get_outside_kerf(kerf_tree(), parameters)['Face1']['Visible']
+    assert both['Hidden'] == get_inside_kerf(kerf_tree(), parameters)['Face1']['Hidden']
+    assert both['Visible']['paths'] and both['Hidden']['paths']
@@ -0,0 +1,29 @@
+"""tests of the result cache"""
+
+from laser_cache import ResultCache, result_key
+
+MODEL = {'tree': {}, 'attrib': {'viewBox': "0 0 10 10"}, 'joints': {}}
+
+
+def test_disk_round_trip(tmp_path):
+    """a result written by one cache is read back by another on the same directory"""
+    key = result_key('output', MODEL, {'kerf': 0.1})
+    ResultCache(directory=str(tmp_path)).put(key, b"<svg />")
+
+    cache = ResultCache(directory=str(tmp_path))
+    assert cache.get(key) == b"<svg />"
+    assert cache.info()['disk_hits'] == 1
+    assert cache.get(key) == b"<svg />"
+    assert cache.info()['hits'] == 1
+
+
+def test_changed_key_misses(tmp_path):
+    """changing any part of the key (eg. a parameter) finds nothing"""
+    cache = ResultCache(directory=str(tmp_path))
+    cache.put(result_key('output', MODEL, {'kerf': 0.1}), b"<svg />")
+    assert result_key('output', MODEL, {'kerf': 0.1}) == \
+        result_key('output', dict(reversed(list(MODEL.items()))), {'kerf': 0.1})
+
+    assert cache.get(result_key('output', MODEL, {'kerf': 0.2})) is None
+    assert cache.get(result_key('design', MODEL, {'kerf': 0.1})) is None
+    assert cache.info()['misses'] == 2
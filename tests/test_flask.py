@@ -0,0 +1,135 @@
+"""tests of the flask server routes"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from laser_flask import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODEL = {'tree': {}, 'attrib': {'viewBox': "0 0 10 10"}, 'joints': {},
+         'edge_data': {}, 'joint_index': 1}
+
+
+@pytest.fixture(name='client')
+def fixture_client():
+    """a test client of the server"""
+    return app.test_client()
+
+
+@pytest.fixture(name='session_id')
+def fixture_session_id(client):
+    """id of a new session holding a blank model"""
+    response = client.post('/sessions', data={'inputModel': json.dumps(MODEL),
+                                              'laserParams': json.dumps({'kerf': 0.1})})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+@pytest.mark.parametrize('request_args', [
+    {'data': {'patch': "[{'op': 'replace'"}},
+    {'data': {}},
+    {'data': b"[{\"op\": ", 'content_type': 'application/json'},
+    {'json': {'op': 'replace', 'path': '/params/kerf', 'value': 1}},
+    {'json': [{'op': 'move', 'path': '/params/kerf', 'from': '/params/x'}]},
+    {'json': [{'op': 'replace', 'path': 'params/kerf', 'value': 1}]},
+    {'json': [{'op': 'replace', 'path': '/model/nope/x', 'value': 1}]},
+    {'json': [{'op': 'replace', 'path': '/params/kerf'}]},
+    {'json': [{'op': 'test', 'path': '/params/kerf', 'value': 5}]},
+])
+def test_malformed_patch_is_rejected(client, session_id, request_args):
+    """a patch that can't be read or applied is a 400 and leaves the session alone"""
+    response = client.patch(f'/sessions/{session_id}', **request_args)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+    response = client.patch(f'/sessions/{session_id}',
+                            json=[{'op': 'test', 'path': '/params/kerf', 'value': 0.1}])
+    assert response.get_json()['version'] == 1
+
+
+def test_patch_unknown_session(client):
+    """patching a session that doesn't exist is a 404"""
+    response = client.patch('/sessions/nope', json=[])
+    assert response.status_code == 404
+
+
+def test_conditional_only_for_get(client, session_id):
+    """If-None-Match gets a 304 on GET, but a POST always gets the svg"""
+    form = {'inputModel': json.dumps(MODEL), 'laserParams': json.dumps({'kerf': 0.1})}
+    first = client.post('/get_design', data=form)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    posted = client.post('/get_design', data=form, headers={'If-None-Match': etag})
+    assert posted.status_code == 200
+    assert posted.data == first.data
+
+    design = client.get(f'/sessions/{session_id}/design')
+    assert design.headers['ETag'] == etag
+    assert client.get(f'/sessions/{session_id}/design',
+                      headers={'If-None-Match': etag}).status_code == 304
+
+
+# metrics are switched on when modules are imported, so run in a fresh process
+SERVER_TIMING_SCRIPT = """
+import json
+from laser_flask import app
+
+model = {'tree': {}, 'attrib': {'viewBox': "0 0 10 10"}, 'joints': {},
+         'edge_data': {}, 'joint_index': 1}
+form = {'inputModel': json.dumps(model),
+        'laserParams': json.dumps({'kerf': 0.1, 'scaleFactor': 1.0})}
+client = app.test_client()
+first = client.post('/get_output', data=form)
+cached = client.post('/get_output', data=form)
+print(json.dumps({'status': [first.status_code, cached.status_code],
+                  'first': first.headers.get('Server-Timing'),
+                  'cached': cached.headers.get('Server-Timing')}))
+"""
+
+
+def test_server_timing_only_when_rendered():
+    """a render sends its stage timings, a cached result sends no Server-Timing"""
+    env = dict(os.environ, LASER_METRICS='1', LASER_WORKERS='1')
+    output = subprocess.run([sys.executable, '-c', SERVER_TIMING_SCRIPT], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    assert result['status'] == [200, 200]
+    assert result['first']
+    assert 'output' in result['first']
+    assert result['cached'] is None
+
+
+def test_get_model_rejects_bad_metadata(client):
+    """an upload with unreadable embeded metadata is a 400, not a 500"""
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg"><metadata>'
+           '<laserassistant model="lazb1:not*base64" /></metadata></svg>')
+    response = client.post('/get_model', data={'svgInput': svg})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_zero_tolerance_is_a_bad_request(client):
+    """a tolerance of 0 in the laser parameters is a 400, not a 500"""
+    form = {'inputModel': json.dumps(MODEL),
+            'laserParams': json.dumps({'kerf': 0.1, 'scaleFactor': 1.0, 'tolerance': 0})}
+    response = client.post('/get_output', data=form)
+    assert response.status_code == 400
+    assert 'tolerance' in response.get_json()['error']
+
+
+def test_unknown_kerf_join_is_a_bad_request(client):
+    """a kerf_join that isn't a clipper join type is a 400, not a 500"""
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">'
+           '<rect x="0" y="0" width="100" height="100" /></svg>')
+    model = client.post('/get_model', data={'svgInput': svg}).get_json()
+    params = {'thickness': 3.0, 'kerf': 0.1, 'scaleFactor': 1.0, 'kerf_join': 'bevel'}
+    response = client.post('/get_output', data={'inputModel': json.dumps(model),
+                                                'laserParams': json.dumps(params)})
+    assert response.status_code == 400
+    assert 'kerf_join' in response.get_json()['error']
@@ -0,0 +1,34 @@
+"""tests of the stage timings"""
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# metrics are switched on when modules are imported, so run in a fresh process
+FACE_TIMING_SCRIPT = """
+import json
+import laser_metrics
+from laser_assistant import get_kerf_join, processed_face
+
+square = 'M 0 0 L 10 0 L 10 10 L 0 10 Z'
+for _ in range(5):
+    kerf_join = get_kerf_join({'kerf_join': 'miter'}, 'face1')
+paths = processed_face(([square], [], [], [], 0.1, 0.01, kerf_join))
+print(json.dumps({'paths': paths, 'timings': laser_metrics.snapshot()['timings']}))
+"""
+
+
+def test_face_stage_times_face_processing():
+    """the 'face' stage is recorded once per processed face, not per join lookup"""
+    env = dict(os.environ, LASER_METRICS='1', LASER_WORKERS='1')
+    output = subprocess.run([sys.executable, '-c', FACE_TIMING_SCRIPT], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    assert result['paths']
+    face = result['timings']['face']
+    assert face['count'] == 1
+    # the clipper stages run inside the face, so they can't take longer than it
+    assert face['seconds'] >= result['timings']['clipper.offset']['seconds']
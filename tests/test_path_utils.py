@@ -0,0 +1,49 @@
+"""tests of the path helpers"""
+
+from laser_clipper import point_on_loops
+from laser_path_utils import (get_segment_index, points_on_segments,
+                              split_overlapping, separate_closed_paths, SNAP_TOLERANCE)
+
+SQUARE = [[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 10.0]]
+
+
+def test_points_on_segments_matches_clipper():
+    """points count as on an edge exactly when pyclipper says so,
+    including ones a fraction of a clipper unit off the edge"""
+    points = [[5.0, 0.0], [5.0, 0.00098], [5.0, -0.0002], [5.0, 0.0011],
+              [10.0, 10.0], [0.00007, 5.0], [3.0, 3.0], [10.5, 5.0]]
+    on_flags = points_on_segments(points, get_segment_index([SQUARE]))
+    assert on_flags == [point_on_loops(point, [SQUARE]) for point in points]
+    assert on_flags[1] and on_flags[5]
+
+
+def test_split_overlapping():
+    """a path along part of a square splits into the shared and the rest"""
+    square = "M 0,0 L 10,0 L 10,10 L 0,10 Z"
+    notch = "M 0,0 L 10,0 L 10,10 L 5,15 L 0,10 Z"
+    overlapping, not_overlapping = split_overlapping([notch], [square])
+    assert not_overlapping == [" M 10.0,10.0 L 5.0,15.0 L 0.0,10.0"]
+    assert overlapping == [" M 0.0,0.0 L 10.0,0.0 L 10.0,10.0",
+                           " M 0.0,10.0 L 0.0,0.0"]
+
+
+def half_squares(gap):
+    """returns two open halves of a square whose ends miss by gap at one corner"""
+    return ["M 0,0 L 10,0 L 10,10", f"M {10 + gap!r},10 L 0,10 L 0,0"]
+
+
+def test_stitches_ends_just_inside_snap_tolerance():
+    """ends a little closer than SNAP_TOLERANCE are joined into a closed path"""
+    closed_paths, open_paths = separate_closed_paths(half_squares(SNAP_TOLERANCE / 2))
+    assert open_paths == []
+    assert len(closed_paths) == 1
+    # the gap is closed by snapping, so the path ends where it starts
+    points = closed_paths[0].split()
+    assert points[1] == points[-1]
+
+
+def test_keeps_ends_just_outside_snap_tolerance_apart():
+    """ends a little further than SNAP_TOLERANCE apart leave the path open"""
+    closed_paths, open_paths = separate_closed_paths(half_squares(SNAP_TOLERANCE * 2))
+    assert closed_paths == []
+    assert len(open_paths) == 1
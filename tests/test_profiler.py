@@ -0,0 +1,26 @@
+"""tests of the slow request profiler"""
+
+import json
+
+from laser_profiler import SlowRequestProfiler
+
+
+def test_inputs_function_only_called_when_slow(tmp_path):
+    """inputs given as a function are built for a saved capture only"""
+    calls = []
+
+    def inputs():
+        calls.append(1)
+        return {'inputModel': "{}"}
+
+    fast = SlowRequestProfiler(directory=str(tmp_path / "fast"), threshold=60)
+    assert fast.run('get_output', inputs, sum, [1, 2]) == 3
+    assert not calls
+    assert not fast.captures()
+
+    slow = SlowRequestProfiler(directory=str(tmp_path / "slow"), threshold=0)
+    assert slow.run('get_output', inputs, sum, [1, 2]) == 3
+    assert calls == [1]
+    capture, = slow.captures()
+    with open(tmp_path / "slow" / (capture + ".json")) as input_file:
+        assert json.load(input_file)['inputs'] == {'inputModel': "{}"}
@@ -0,0 +1,42 @@
+"""tests of json-patch sessions"""
+
+import copy
+
+import pytest
+
+from laser_sessions import SessionStore, apply_patch
+
+DOCUMENT = {'model': {'joints': {'J1': {'joint_type': 'tab'}}, 'faces': ['a', 'b']},
+            'params': {'kerf': 0.1}}
+
+
+def test_apply_patch_operations():
+    """add, replace, remove and test each change (or check) the document"""
+    original = copy.deepcopy(DOCUMENT)
+    patched = apply_patch(DOCUMENT, [
+        {'op': 'test', 'path': '/params/kerf', 'value': 0.1},
+        {'op': 'add', 'path': '/params/material', 'value': 'Wood'},
+        {'op': 'add', 'path': '/model/faces/1', 'value': 'c'},
+        {'op': 'add', 'path': '/model/faces/-', 'value': 'd'},
+        {'op': 'replace', 'path': '/params/kerf', 'value': 0.2},
+        {'op': 'replace', 'path': '/model/joints/J1/joint_type', 'value': 'bolt'},
+        {'op': 'remove', 'path': '/model/faces/0'},
+    ])
+    assert patched == {'model': {'joints': {'J1': {'joint_type': 'bolt'}},
+                                 'faces': ['c', 'b', 'd']},
+                       'params': {'kerf': 0.2, 'material': 'Wood'}}
+    assert DOCUMENT == original
+
+
+def test_failing_test_operation_changes_nothing():
+    """a test op that doesn't match stops the patch with a ValueError"""
+    with pytest.raises(ValueError, match="test failed"):
+        apply_patch(DOCUMENT, [{'op': 'replace', 'path': '/params/kerf', 'value': 0.2},
+                               {'op': 'test', 'path': '/params/kerf', 'value': 0.1}])
+
+    store = SessionStore()
+    session_id = store.create(DOCUMENT['model'], DOCUMENT['params'])
+    with pytest.raises(ValueError, match="test failed"):
+        store.update(session_id, [{'op': 'replace', 'path': '/params/kerf', 'value': 0.2},
+                                  {'op': 'test', 'path': '/params/kerf', 'value': 0.1}])
+    assert store.get(session_id) == (DOCUMENT, 0)
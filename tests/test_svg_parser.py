@@ -0,0 +1,44 @@
+"""tests of reading and writing the embeded model"""
+
+import base64
+import zlib
+
+import pytest
+
+import laser_svg_parser
+from laser_svg_parser import decode_model, encode_model
+
+MODEL = {'tree': {'face1': {'Perimeter': {'paths': ["M 0 0 L 10 0 L 10 10 Z"]}}},
+         'attrib': {'viewBox': "0 0 10 10"}, 'joints': {}, 'joint_index': 1}
+
+
+def compact_payload(data):
+    """returns compact metadata text holding raw bytes"""
+    return f"lazb1:{base64.b64encode(zlib.compress(data)).decode('ascii')}"
+
+
+def test_model_round_trips_in_both_encodings():
+    """plain and compact metadata both decode back to the model"""
+    assert decode_model(encode_model(MODEL, compact=False)) == MODEL
+    assert decode_model(encode_model(MODEL, compact=True)) == MODEL
+
+
+def test_decompression_is_capped(monkeypatch):
+    """a payload inflating past MAX_MODEL_BYTES is refused"""
+    monkeypatch.setattr(laser_svg_parser, 'MAX_MODEL_BYTES', 1000)
+    bomb = compact_payload(b" " * 100000)
+    assert len(bomb) < 1000
+    with pytest.raises(ValueError, match="over 1000 bytes"):
+        decode_model(bomb)
+
+
+@pytest.mark.parametrize('text', [
+    "zzz9:abc",
+    "lazb1:not*base64",
+    "lazb1:" + base64.b64encode(b"not zlib").decode('ascii'),
+    compact_payload(b'{"tree": {}}')[:-8],
+])
+def test_bad_payloads_raise_value_error(text):
+    """unknown encodings, bad base64 and bad or cut short zlib are ValueErrors"""
+    with pytest.raises(ValueError):
+        decode_model(text)